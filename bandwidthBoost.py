@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+import configInit
+import runCoordinator
+import scanDispatcher
+import sqliteDB
+
+# scope of the global rate limits in /rest/config/options - the other scopes are device ids
+OPTIONS_SCOPE = "options"
+
+# hidden env vars: how often the remote side's completion is checked while the limits are raised, and how long to wait
+# after the run before the first check (right after the scan the remote side may not have seen the changes yet)
+POLL_SECONDS = float(os.getenv("BANDWIDTH_POLL_SECONDS", "60"))
+SETTLE_SECONDS = float(os.getenv("BANDWIDTH_SETTLE_SECONDS", "120"))
+
+_watchers = {}
+_watchersLock = threading.Lock()
+
+
+def _request(config, method, path, **kwargs):
+    session = scanDispatcher.getSession(config.url, config.scanConcurrency)
+    response = session.request(method, f"{config.url}{path}", headers={"X-API-Key": config.apiKey},
+                               timeout=config.scanRequestTimeout, **kwargs)
+    response.raise_for_status()
+    return response.json() if response.content else None
+
+
+def _scopePath(scope):
+    return "/rest/config/options" if scope == OPTIONS_SCOPE else f"/rest/config/devices/{scope}"
+
+
+def boost(config):
+    """Raises the rate limits (globally, or of the configured devices) to the backup window values. The original
+    limits are stored in sqlite before anything is changed."""
+    scopes = config.boostDevices or [OPTIONS_SCOPE]
+    expiresAt = time.time() + config.boostDeadlineMinutes * 60
+    originals = []
+    for scope in scopes:
+        current = _request(config, "GET", _scopePath(scope))
+        originals.append(sqliteDB.BandwidthBoost(config.name, scope, current.get("maxSendKbps", 0),
+                                                 current.get("maxRecvKbps", 0), expiresAt))
+    sqliteDB.save_bandwidth_boosts(originals)
+
+    for scope in scopes:
+        _request(config, "PATCH", _scopePath(scope),
+                 json={"maxSendKbps": config.boostSendKbps, "maxRecvKbps": config.boostRecvKbps})
+    print(f"Raised the bandwidth limits of {scopes} to send {config.boostSendKbps} / receive {config.boostRecvKbps} "
+          f"KiB/s (0 is unlimited) for at most {config.boostDeadlineMinutes} minutes")
+
+
+def restore(config):
+    """Puts the stored original limits of the instance back. A limit that can't be restored stays stored, so it is
+    tried again later."""
+    for stored in sqliteDB.get_bandwidth_boosts(config.name):
+        try:
+            _request(config, "PATCH", _scopePath(stored.scope),
+                     json={"maxSendKbps": stored.maxSendKbps, "maxRecvKbps": stored.maxRecvKbps})
+        except Exception as e:
+            print(f"ERROR: could not restore the bandwidth limits of {stored.scope} on {config.name}: {e}")
+            continue
+        sqliteDB.delete_bandwidth_boost(stored.target, stored.scope)
+        print(f"Restored the bandwidth limits of {stored.scope} on {config.name} to send {stored.maxSendKbps} / "
+              f"receive {stored.maxRecvKbps} KiB/s")
+
+
+def restorePending():
+    # limits left raised by a scheduler that crashed (or a leader that went away) during a backup window
+    for target in sorted({stored.target for stored in sqliteDB.get_bandwidth_boosts()}):
+        config = configInit.getInstance(target)
+        if config is None:
+            print(f"WARNING: the bandwidth limits of {target} are still raised, but it is no longer configured - "
+                  f"please restore them manually!")
+            continue
+        print(f"Restoring the bandwidth limits of {target} that were left raised..")
+        restore(config)
+
+
+def isRemoteComplete(config):
+    # /rest/db/completion without a device aggregates the completion of every remote device
+    for device in config.boostDevices or [None]:
+        completion = _request(config, "GET", "/rest/db/completion", params={"device": device} if device else None)
+        if completion.get("completion", 0) < 100 or completion.get("needBytes", 0) > 0:
+            return False
+    return True
+
+
+def _watch(target):
+    time.sleep(SETTLE_SECONDS)
+    while True:
+        stored = sqliteDB.get_bandwidth_boosts(target)
+        config = configInit.getInstance(target)
+        if not stored or config is None:
+            return
+
+        done = time.time() >= min(s.expiresAt for s in stored)
+        if target in runCoordinator.coordinator.inFlight():
+            # the next run already started and boosted again - its own deadline counts from now on
+            done = False
+        elif done:
+            print(f"The backup window of {target} is over - restoring the bandwidth limits")
+        else:
+            try:
+                done = isRemoteComplete(config)
+            except Exception as e:
+                print(f"Could not read the completion of the remote devices of {target}: {e}")
+            if done:
+                print(f"The remote devices of {target} are in sync - restoring the bandwidth limits")
+        if done:
+            restore(config)
+            if not sqliteDB.get_bandwidth_boosts(target):
+                return
+        time.sleep(POLL_SECONDS)
+
+
+def restoreWhenDone(config):
+    """Restores the limits in the background once the remote side reports completion or the deadline passed."""
+    with _watchersLock:
+        watcher = _watchers.get(config.name)
+        if watcher is not None and watcher.is_alive():
+            return
+        watcher = threading.Thread(target=_watch, args=(config.name,), name=f"bandwidth-{config.name}", daemon=True)
+        _watchers[config.name] = watcher
+        watcher.start()
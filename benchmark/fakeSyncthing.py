@@ -0,0 +1,138 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+MY_ID = "LOCAL00-0000000-0000000-0000000-0000000-0000000-0000000-0000000"
+REMOTE_ID = "REMOTE0-0000000-0000000-0000000-0000000-0000000-0000000-0000000"
+
+
+class FakeSyncthing:
+    """A local stand-in for the parts of the Syncthing REST api the scheduler uses. Every request waits `latency`
+    seconds (plus up to `jitter`) and fails with a 500 with probability `errorRate`. Every folder is shared with one
+    remote device, which is in sync unless `needBytes` says otherwise."""
+
+    def __init__(self, folderCount: int, latency: float = 0.0, jitter: float = 0.0, errorRate: float = 0.0,
+                 seed: int = 1):
+        self.folders = [f"folder-{i:04d}" for i in range(folderCount)]
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        self.randomLock = threading.Lock()
+        self.events = []
+        self.eventsCond = threading.Condition()
+        self.requestCount = 0
+        # (folder, device) -> bytes the remote device still needs
+        self.needBytes = {}
+        self.remoteConnected = True
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def folderStatus(self, folder):
+        index = self.folders.index(folder)
+        return {"localBytes": (index + 1) * 1000 ** 2, "localFiles": index + 1, "globalFiles": index + 1,
+                "needBytes": 0, "sequence": index + 1, "state": "idle"}
+
+    def addEvent(self, eventType, data):
+        with self.eventsCond:
+            self.events.append({"id": len(self.events) + 1, "type": eventType, "data": data,
+                                "time": datetime.now(timezone.utc).isoformat()})
+            self.eventsCond.notify_all()
+
+    def _delayAndMaybeFail(self):
+        with self.randomLock:
+            self.requestCount += 1
+            delay = self.latency + self.random.random() * self.jitter
+            failed = self.random.random() < self.errorRate
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, code, body=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path.rstrip("/") != "/rest/db/scan":
+                    return self.reply(404)
+                folders = query.get("folder", fake.folders)
+                for folder in folders:
+                    fake.addEvent("StateChanged", {"folder": folder, "from": "idle", "to": "scanning"})
+                if fake._delayAndMaybeFail():
+                    return self.reply(500, {"error": "injected failure"})
+                for folder in folders:
+                    fake.addEvent("StateChanged", {"folder": folder, "from": "scanning", "to": "idle"})
+                self.reply(200)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == "/rest/system/ping":
+                    return self.reply(200, {"ping": "pong"})
+                if url.path == "/rest/config/folders":
+                    return self.reply(200, [{"id": folder, "paused": False,
+                                             "devices": [{"deviceID": MY_ID}, {"deviceID": REMOTE_ID}]}
+                                            for folder in fake.folders])
+                if url.path == "/rest/system/status":
+                    return self.reply(200, {"myID": MY_ID})
+                if url.path == "/rest/system/connections":
+                    return self.reply(200, {"connections": {REMOTE_ID: {"connected": fake.remoteConnected}}})
+                if url.path == "/rest/db/completion":
+                    need = fake.needBytes.get((query["folder"][0], query["device"][0]), 0)
+                    return self.reply(200, {"completion": 100 if need == 0 else 50, "needBytes": need})
+                if url.path == "/rest/events":
+                    return self.events(query)
+                if url.path == "/rest/db/status":
+                    if fake._delayAndMaybeFail():
+                        return self.reply(500, {"error": "injected failure"})
+                    return self.reply(200, fake.folderStatus(query["folder"][0]))
+                self.reply(404)
+
+            def events(self, query):
+                types = set(query["events"][0].split(",")) if "events" in query else None
+                since = int(query.get("since", ["0"])[0])
+                timeout = float(query.get("timeout", ["60"])[0])
+                limit = int(query.get("limit", ["0"])[0])
+
+                def matching():
+                    return [e for e in fake.events[since:] if types is None or e["type"] in types]
+
+                with fake.eventsCond:
+                    fake.eventsCond.wait_for(lambda: matching(), timeout=timeout)
+                    events = matching()
+                self.reply(200, events[-limit:] if limit > 0 else events)
+
+        return Handler
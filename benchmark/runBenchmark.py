@@ -0,0 +1,256 @@
+"""Runs the scheduler against a local fake Syncthing through repeatable scenarios and saves the results as JSON.
+
+Usage: python benchmark/runBenchmark.py [--output results.json] [--scenario NAME ...]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakeSyncthing import FakeSyncthing  # noqa: E402
+
+import configInit  # noqa: E402
+import main as schedulerMain  # noqa: E402
+import sqliteDB  # noqa: E402
+import statusController  # noqa: E402
+
+
+@dataclass
+class ScanScenario:
+    name: str
+    folders: int
+    latency: float
+    jitter: float = 0.0
+    errorRate: float = 0.0
+    concurrency: int = 8
+    waitForCompletion: bool = False
+
+
+SCAN_SCENARIOS = [
+    ScanScenario("folders_10", 10, latency=0.02),
+    ScanScenario("folders_100", 100, latency=0.02),
+    ScanScenario("folders_1000", 1000, latency=0.02),
+    ScanScenario("folders_100_flaky", 100, latency=0.02, jitter=0.2, errorRate=0.2),
+    ScanScenario("folders_100_wait_for_completion", 100, latency=0.02, waitForCompletion=True),
+]
+
+STATUS_REQUESTS = 5000
+
+COLD_START_RUNS = 5
+# /status should answer this many seconds after the process was started
+COLD_START_TARGET_SECONDS = 1.0
+COLD_START_TIMEOUT = 30
+
+
+def percentiles(values):
+    if len(values) < 2:
+        return {"p50": values[0] if values else None, "p99": values[0] if values else None}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p99": cuts[98]}
+
+
+def buildConfig(fake, scenario: ScanScenario):
+    return configInit.Config(url=fake.url, apiKey="benchmark", foldersToScan=list(fake.folders), allFolders=False,
+                             weeklySchedule=None, dailySchedule=None, lastDayOfMonthSchedule=None, tz="UTC",
+                             WOLImage=None, WOLMacAddr=None, scanConcurrency=scenario.concurrency,
+                             scanRequestTimeout=30, scanOverallTimeout=600,
+                             waitForScanCompletion=scenario.waitForCompletion, scanCompletionTimeout=600)
+
+
+def runScanScenario(scenario: ScanScenario):
+    fake = FakeSyncthing(scenario.folders, scenario.latency, scenario.jitter, scenario.errorRate).start()
+    try:
+        config = buildConfig(fake, scenario)
+        tracemalloc.start()
+        start = time.perf_counter()
+        # the scheduler prints a line per folder, which would dominate the measurement
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            schedulerMain.runPostRequest(config)
+        elapsed = time.perf_counter() - start
+        _, peakBytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results = sqliteDB.get_last_run_folder_results()
+        durations = [r["duration"] for r in results if r["duration"] is not None]
+        return {
+            "folders": scenario.folders,
+            "upstreamLatency": scenario.latency,
+            "errorRate": scenario.errorRate,
+            "concurrency": scenario.concurrency,
+            "seconds": elapsed,
+            "foldersPerSecond": scenario.folders / elapsed if elapsed > 0 else None,
+            "failedFolders": sum(1 for r in results if r["code"] != 200),
+            "folderLatency": percentiles(durations),
+            "peakTracedBytes": peakBytes,
+            "upstreamRequests": fake.requestCount,
+        }
+    finally:
+        fake.stop()
+
+
+def runStatusScenario(conditional: bool):
+    client = statusController.app.test_client()
+    etag = client.get("/status").headers.get("ETag")
+    headers = {"If-None-Match": etag} if conditional and etag else {}
+
+    latencies = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(STATUS_REQUESTS):
+        reqStart = time.perf_counter()
+        client.get("/status", headers=headers)
+        latencies.append(time.perf_counter() - reqStart)
+    elapsed = time.perf_counter() - start
+    _, peakBytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "requests": STATUS_REQUESTS,
+        "conditional": conditional,
+        "seconds": elapsed,
+        "requestsPerSecond": STATUS_REQUESTS / elapsed,
+        "latency": percentiles(latencies),
+        "peakTracedBytes": peakBytes,
+    }
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def coldStart(workDir, configFile, run):
+    """Starts the scheduler as a fresh process like the container does. Returns the seconds until /status answered and
+    until the startup was done."""
+    port = freePort()
+    env = dict(os.environ, CONFIG_FILE=configFile, SQLITE_DB_PATH=os.path.join(workDir, f"cold-{run}.db"), TZ="UTC",
+               API_PORT=str(port))
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", os.path.join(ROOT, "main.py")], cwd=ROOT, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    ready = {}
+
+    def readOutput():
+        for line in process.stdout:
+            if line.startswith("Started in") and "seconds" not in ready:
+                ready["seconds"] = time.perf_counter() - start
+
+    reader = threading.Thread(target=readOutput, daemon=True)
+    reader.start()
+    try:
+        statusSeconds = None
+        while statusSeconds is None and time.perf_counter() - start < COLD_START_TIMEOUT:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=1).close()
+                statusSeconds = time.perf_counter() - start
+            except urllib.error.HTTPError:
+                # e.g. a 400 before the first status was written - the api answers, which is what counts
+                statusSeconds = time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        while "seconds" not in ready and process.poll() is None and time.perf_counter() - start < COLD_START_TIMEOUT:
+            time.sleep(0.005)
+        return statusSeconds, ready.get("seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def runColdStartScenario(workDir):
+    fake = FakeSyncthing(10).start()
+    try:
+        configFile = os.path.join(workDir, "config.yml")
+        with open(configFile, "w") as f:
+            f.write(f"general_settings:\n  url: {fake.url}\n  api_key: benchmark\n"
+                    f"backup_schedule:\n  daily:\n    time: \"03:00\"\n")
+        runs = [coldStart(workDir, configFile, run) for run in range(COLD_START_RUNS)]
+    finally:
+        fake.stop()
+
+    statusTimes = [status for status, _ in runs if status is not None]
+    readyTimes = [ready for _, ready in runs if ready is not None]
+    statusLatency = percentiles(statusTimes)
+    return {
+        "runs": COLD_START_RUNS,
+        "failedRuns": COLD_START_RUNS - len(statusTimes),
+        "statusSeconds": statusLatency,
+        "startupSeconds": percentiles(readyTimes),
+        "target": COLD_START_TARGET_SECONDS,
+        "withinTarget": statusLatency["p50"] is not None and statusLatency["p50"] <= COLD_START_TARGET_SECONDS,
+    }
+
+
+def gitVersion():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="where to write the JSON results")
+    parser.add_argument("--scenario", action="append", help="only run these scenarios (can be repeated)")
+    args = parser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix="syncthing-scheduler-bench-")
+    sqliteDB.init_db(os.path.join(workDir, "bench.db"))
+
+    scenarios = {}
+    for scenario in SCAN_SCENARIOS:
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        print(f"=== {scenario.name}")
+        scenarios[scenario.name] = runScanScenario(scenario)
+    for conditional in [False, True]:
+        name = "status_etag" if conditional else "status"
+        if args.scenario and name not in args.scenario:
+            continue
+        print(f"=== {name}")
+        scenarios[name] = runStatusScenario(conditional)
+    if not args.scenario or "cold_start" in args.scenario:
+        print("=== cold_start")
+        scenarios["cold_start"] = runColdStartScenario(workDir)
+
+    report = {
+        "version": gitVersion(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "maxRssKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "scenarios": scenarios,
+    }
+
+    output = args.output or os.path.join(ROOT, "benchmark", "results",
+                                         f"{report['version'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps({name: {k: v for k, v in result.items() if k in ["seconds", "foldersPerSecond",
+                                                                        "requestsPerSecond", "folderLatency",
+                                                                        "latency", "failedFolders", "statusSeconds",
+                                                                        "startupSeconds", "withinTarget"]}
+                      for name, result in scenarios.items()}, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
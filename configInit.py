@@ -1,13 +1,18 @@
+import dataclasses
+import hashlib
+import re
 import sys
+import threading
 from dataclasses import dataclass
 from os import path
 from typing import List
+from urllib.parse import urlparse
 import util
 import yaml
+import scanPlanner
+import schedules
 import sqliteDB
-from environs import Env
 import os
-import macaddress
 
 @dataclass
 class ConfSchedule:
@@ -29,59 +34,151 @@ class Config:
     tz: str
     WOLImage: str
     WOLMacAddr: str
+    scanConcurrency: int = 4
+    scanRequestTimeout: float = 300
+    scanOverallTimeout: float = 3600
+    waitForScanCompletion: bool = False
+    scanCompletionTimeout: float = 3600
+    cronSchedules: List[str] = None
+    coalesceSeconds: float = 10
+    catchUpGraceHours: float = 12
+    scanStaggerMinutes: float = 0
+    scanMaxConcurrentGB: float = 0
+    scanOrder: str = "config"
+    incrementalScan: bool = False
+    incrementalMaxAgeHours: float = 168
+    retryMaxAttempts: int = 3
+    retryBaseSeconds: float = 60
+    retryMaxSeconds: float = 1800
+    breakerThreshold: int = 5
+    breakerCooldownMinutes: float = 60
+    historyRetentionDays: int = 365
+    historyMaxRuns: int = 10000
+    WOLBroadcastAddr: str = "255.255.255.255"
+    WOLPort: int = 9
+    WOLRepeat: int = 3
+    WOLUseDocker: bool = False
+    WOLProbeHost: str = None
+    WOLProbePort: int = 22000
+    WOLProbeTimeout: float = 300
+    hostConcurrency: int = 8
+    syncMonitorEnabled: bool = False
+    syncMonitorTimeoutMinutes: float = 480
+    boostEnabled: bool = False
+    boostSendKbps: int = 0
+    boostRecvKbps: int = 0
+    boostDevices: List[str] = None
+    boostDeadlineMinutes: float = 480
+    coordinationEnabled: bool = False
+    coordinationLeaseSeconds: float = 30
+    coordinationNodeId: str = None
+    name: str = "default"
+    # the syncthing instances to schedule - just this config itself unless the config file has an instances list
+    instances: list = None
 
 
 # can be found here: https://hub.docker.com/r/r0gger/docker-wake-on-lan/tags
 # hidden env var to set the image of the wake on lan docker image
 WOL_R0GGER_IMAGE = os.getenv("WOL_R0GGER_IMAGE", "r0gger/docker-wake-on-lan:latest")
+# hidden env var to set the location of the config file
+CONFIG_FILE = os.getenv("CONFIG_FILE", "/yaml/config.yml")
 
+DEFAULT_INSTANCE = "default"
+INSTANCE_NAME_PATTERN = r"^[A-Za-z0-9_.-]+$"
+# names that are taken by the api's own /status/<name> routes
+RESERVED_INSTANCE_NAMES = ["wait"]
+WOL_FIELDS = ["WOLMacAddr", "WOLBroadcastAddr", "WOLPort", "WOLRepeat", "WOLUseDocker", "WOLProbeHost", "WOLProbePort",
+              "WOLProbeTimeout"]
 
-conf = Config(None, None, None, None, None, None, None, None, WOL_R0GGER_IMAGE, None)
+# the parsed config is cached and only parsed again when the file's stat and content hash change
+_cacheLock = threading.Lock()
+_cachedConf = None
+_cachedStat = None
+_cachedHash = None
+# set while a changed config file is parsed - an invalid one must not stop the scheduler then
+_reloading = False
 
 
-def checkMandatoryFields():
+class ReloadError(Exception):
+    """The changed config file is not valid - the previous config stays active."""
+
+
+def exitWithError(errMsg: str, *details):
+    if _reloading:
+        raise ReloadError(" ".join([errMsg, *map(str, details)]))
+    print(f"{errMsg} Now exiting!", *details)
+    sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
+    sys.exit()
+
+
+def checkMandatoryFields(conf):
+    where = "" if conf.name == DEFAULT_INSTANCE else f" (instance {conf.name})"
     if conf.url is None:
-        errMsg = "ERROR: Url of the Syncthing GUI must be inputted!"
-        print(f"{errMsg} Now exiting!")
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
+        errMsg = f"ERROR: Url of the Syncthing GUI must be inputted!{where}"
+        exitWithError(errMsg)
     if conf.apiKey is None:
-        errMsg = "ERROR: API KEY of the Syncthing service must be inputted!"
-        print(f"{errMsg} Now exiting!")
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
-    if conf.weeklySchedule is None and conf.dailySchedule is None and conf.lastDayOfMonthSchedule is None:
-        errMsg = "ERROR: At least one backup schedule must be setup in order for the script to work!"
-        print(f"{errMsg} Now exiting!")
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
+        errMsg = f"ERROR: API KEY of the Syncthing service must be inputted!{where}"
+        exitWithError(errMsg)
+    if conf.weeklySchedule is None and conf.dailySchedule is None and conf.lastDayOfMonthSchedule is None and \
+            not conf.cronSchedules:
+        errMsg = f"ERROR: At least one backup schedule must be setup in order for the script to work!{where}"
+        exitWithError(errMsg)
     if conf.weeklySchedule is not None and (conf.weeklySchedule.time is None or conf.weeklySchedule.day is None):
-        errMsg = "ERROR: Weekly Schedule must have TIME and DAY setup!"
-        print(f"{errMsg} Now exiting!")
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
+        errMsg = f"ERROR: Weekly Schedule must have TIME and DAY setup!{where}"
+        exitWithError(errMsg)
     if conf.lastDayOfMonthSchedule is not None and (
             conf.lastDayOfMonthSchedule.time is None or conf.lastDayOfMonthSchedule.day is None):
-        errMsg = "ERROR: Last Day Of Month Schedule must have TIME and DAY setup!"
-        print(f"{errMsg} Now exiting!")
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
+        errMsg = f"ERROR: Last Day Of Month Schedule must have TIME and DAY setup!{where}"
+        exitWithError(errMsg)
     if conf.dailySchedule is not None and conf.dailySchedule.time is None:
-        errMsg = "ERROR: Daily Schedule must have TIME field setup!"
-        print(f"{errMsg} Now exiting!")
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
+        errMsg = f"ERROR: Daily Schedule must have TIME field setup!{where}"
+        exitWithError(errMsg)
 
 
-def printSetConfig():
+def printSetConfig(conf):
     resultStr = "The following config params were set:\n"
+    if conf.name != DEFAULT_INSTANCE:
+        resultStr += f"- instance = {conf.name}\n"
     resultStr += f"- url = {conf.url}\n"
-    resultStr += f"- api_key = {conf.apiKey}\n"
+    resultStr += f"- api_key = {maskSecret(conf.apiKey)}\n"
     if conf.allFolders is False:
         resultStr += f"- folders_to_scan = {conf.foldersToScan}\n"
     else:
         resultStr += f"- All folders will be rescanned\n"
     resultStr += f"- Timezone = {conf.tz}\n"
+    resultStr += f"Scan Settings:\n"
+    resultStr += f"- scan_settings.concurrency = {conf.scanConcurrency}\n"
+    resultStr += f"- scan_settings.host_concurrency = {conf.hostConcurrency}\n"
+    resultStr += f"- scan_settings.request_timeout = {conf.scanRequestTimeout}\n"
+    resultStr += f"- scan_settings.overall_timeout = {conf.scanOverallTimeout}\n"
+    if scanPlanner.isEnabled(conf):
+        resultStr += f"- scan_settings.order = {conf.scanOrder}\n"
+        resultStr += f"- scan_settings.stagger_window = {conf.scanStaggerMinutes}\n"
+        resultStr += f"- scan_settings.max_concurrent_gb = {conf.scanMaxConcurrentGB}\n"
+    resultStr += f"- scan_settings.incremental = {conf.incrementalScan}\n"
+    if conf.incrementalScan:
+        resultStr += f"- scan_settings.max_age_hours = {conf.incrementalMaxAgeHours}\n"
+    resultStr += f"- scan_settings.coalesce_window = {conf.coalesceSeconds}\n"
+    resultStr += f"- scan_settings.wait_for_completion = {conf.waitForScanCompletion}\n"
+    if conf.waitForScanCompletion:
+        resultStr += f"- scan_settings.completion_timeout = {conf.scanCompletionTimeout}\n"
+
+    resultStr += f"Retry Settings:\n"
+    resultStr += f"- retry_settings.max_attempts = {conf.retryMaxAttempts}\n"
+    if conf.retryMaxAttempts > 0:
+        resultStr += f"- retry_settings.base_delay = {conf.retryBaseSeconds}\n"
+        resultStr += f"- retry_settings.max_delay = {conf.retryMaxSeconds}\n"
+        resultStr += f"- retry_settings.breaker_threshold = {conf.breakerThreshold}\n"
+        resultStr += f"- retry_settings.breaker_cooldown = {conf.breakerCooldownMinutes}\n"
+
+    resultStr += f"History Settings:\n"
+    resultStr += f"- history_settings.retention_days = {conf.historyRetentionDays}\n"
+    resultStr += f"- history_settings.max_runs = {conf.historyMaxRuns}\n"
+
+    if conf.coordinationEnabled:
+        resultStr += f"Coordination:\n"
+        resultStr += f"- coordination.node_id = {conf.coordinationNodeId or '<hostname>'}\n"
+        resultStr += f"- coordination.lease_seconds = {conf.coordinationLeaseSeconds}\n"
 
     resultStr += f"Backup Schedule:\n"
     if conf.weeklySchedule is not None:
@@ -92,138 +189,451 @@ def printSetConfig():
     if conf.lastDayOfMonthSchedule is not None:
         resultStr += f"- last_day_of_month.day = {conf.lastDayOfMonthSchedule.day}\n"
         resultStr += f"- last_day_of_month.time = {conf.lastDayOfMonthSchedule.time}\n"
+    for expression in conf.cronSchedules or []:
+        resultStr += f"- cron = {expression}\n"
+    resultStr += f"- catch_up_grace_hours = {conf.catchUpGraceHours}\n"
+    if conf.syncMonitorEnabled:
+        resultStr += f"Sync Monitor:\n"
+        resultStr += f"- sync_monitor.timeout_minutes = {conf.syncMonitorTimeoutMinutes}\n"
+
+    if conf.boostEnabled:
+        resultStr += f"Bandwidth Boost:\n"
+        resultStr += f"- bandwidth_boost.max_send_kbps = {conf.boostSendKbps}\n"
+        resultStr += f"- bandwidth_boost.max_recv_kbps = {conf.boostRecvKbps}\n"
+        resultStr += f"- bandwidth_boost.devices = {conf.boostDevices or 'all (global limits)'}\n"
+        resultStr += f"- bandwidth_boost.deadline_minutes = {conf.boostDeadlineMinutes}\n"
     if conf.WOLMacAddr is not None:
         resultStr += f"Wake On Lan Settings:\n"
         resultStr += f"- wake_on_lan_settings.mac_address = {conf.WOLMacAddr}\n"
+        resultStr += f"- wake_on_lan_settings.broadcast_address = {conf.WOLBroadcastAddr}\n"
+        resultStr += f"- wake_on_lan_settings.port = {conf.WOLPort}\n"
+        resultStr += f"- wake_on_lan_settings.repeat = {conf.WOLRepeat}\n"
+        if conf.WOLUseDocker:
+            resultStr += f"- wake_on_lan_settings.use_docker = {conf.WOLUseDocker}\n"
+        if conf.WOLProbeHost is not None:
+            resultStr += f"- wake_on_lan_settings.probe_host = {conf.WOLProbeHost}\n"
+            resultStr += f"- wake_on_lan_settings.probe_port = {conf.WOLProbePort}\n"
+            resultStr += f"- wake_on_lan_settings.probe_timeout = {conf.WOLProbeTimeout}\n"
 
     print(resultStr)
 
 
+def maskSecret(secret: str):
+    if secret is None or len(secret) <= 4:
+        return "****"
+    return f"****{secret[-4:]}"
+
+
+def fileStat():
+    stat = os.stat(CONFIG_FILE)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def getConfig():
+    # hot path - returns the cached config without touching the file
+    return _cachedConf
+
+
+def getInstances():
+    # empty until initConfig ran - the api is already serving requests during the startup
+    return _cachedConf.instances if _cachedConf is not None else []
+
+
+def getInstance(name: str):
+    return next((instance for instance in getInstances() if instance.name == name), None)
+
+
 def initConfig():
+    global _cachedConf, _cachedStat, _cachedHash
+    with _cacheLock:
+        stat = fileStat() if path.exists(CONFIG_FILE) else None
+        conf, contentHash = parseConfig()
+        _cachedConf, _cachedStat, _cachedHash = conf, stat, contentHash
+        return conf
+
+
+def reloadIfChanged():
+    """Cheap stat check of the config file - the file is only hashed when its mtime or size changed, and only parsed
+    when the content actually differs. Returns the new config, or None when nothing changed or the new file is invalid
+    (the previous config stays active then)."""
+    global _cachedConf, _cachedStat, _cachedHash, _reloading
+    with _cacheLock:
+        try:
+            stat = fileStat()
+        except OSError:
+            return None
+        if stat == _cachedStat:
+            return None
+
+        with open(CONFIG_FILE, 'rb') as f:
+            contentHash = hashlib.sha256(f.read()).hexdigest()
+        _cachedStat = stat
+        if contentHash == _cachedHash:
+            return None
+
+        print("---------------\nConfig file has changed - reloading it..")
+        _reloading = True
+        try:
+            conf, contentHash = parseConfig()
+        except ReloadError as e:
+            # the status is left alone, as the previous config keeps running normally
+            print(f"{e} The changed config file is not valid - keeping the previous config!")
+            _cachedHash = contentHash
+            return None
+        finally:
+            _reloading = False
+        _cachedConf, _cachedHash = conf, contentHash
+        return conf
+
+
+def parseSections(conf, sections):
+    """Parses the settings sections (general_settings, backup_schedule, ...) of the config file, or of one entry
+    of its instances list, into conf."""
+    for k, v in sections.items():
+        if k == "general_settings" and v is not None:
+            for generalKey, generalVal in v.items():
+                if generalKey == "url" and generalVal != "<INSERT YOUR SYNCTHING GUI URL>":
+                    conf.url = generalVal
+                if generalKey == "api_key" and generalVal != "<INSERT YOUR SYNCTHING API KEY>":
+                    conf.apiKey = generalVal
+                if generalKey == "folders_to_scan":
+                    conf.foldersToScan = generalVal
+
+        # Backup Schedule
+        if k == "backup_schedule" and v is not None:
+            for backupKey, backupVal in v.items():
+                if backupKey == "weekly" and backupVal is not None:
+                    weeklySchedule = ConfSchedule(None, None, None, None)
+                    for weeklyKey, weeklyVal in backupVal.items():
+                        if weeklyKey == "day":
+                            if weeklyVal in ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]:
+                                weeklySchedule.day = weeklyVal
+                            else:
+                                errMsg = "ERROR: Weekly schedule's day is not set properly - Please use MON, TUE, WED, THU, FRI, SAT or SUN to specify the day."
+                                exitWithError(errMsg)
+                        if weeklyKey == "time":
+                            if util.isTimeFormat(weeklyVal):
+                                weeklySchedule.time = weeklyVal
+                                hour, minute = util.extractHourAndMinute(weeklyVal)
+                                weeklySchedule.hour = hour
+                                weeklySchedule.minute = minute
+                            else:
+                                errMsg = "ERROR: Weekly time format is not valid! Please use HH:mm format!"
+                                exitWithError(errMsg)
+
+                    conf.weeklySchedule = weeklySchedule
+
+                if backupKey == "daily" and backupVal is not None:
+                    dailySchedule = ConfSchedule(None, None, None, None)
+                    for dailyKey, dailyVal in backupVal.items():
+                        if dailyKey == "time":
+                            if util.isTimeFormat(dailyVal):
+                                dailySchedule.time = dailyVal
+                                hour, minute = util.extractHourAndMinute(dailyVal)
+                                dailySchedule.hour = hour
+                                dailySchedule.minute = minute
+                            else:
+                                errMsg = "ERROR: Daily time format is not valid! Please use HH:mm format!"
+                                exitWithError(errMsg)
+
+                    conf.dailySchedule = dailySchedule
+
+                if backupKey == "last_day_of_month" and backupVal is not None:
+                    lastDaySchedule = ConfSchedule(None, None, None, None)
+                    for lastDayKey, lastDayVal in backupVal.items():
+                        if lastDayKey == "day":
+                            if lastDayVal.upper() in ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]:
+                                lastDaySchedule.day = lastDayVal
+                            else:
+                                errMsg = "ERROR: Last Day Of Month schedule's day is not set properly - Please use MON, TUE, WED, THU, FRI, SAT or SUN to specify the day."
+                                exitWithError(errMsg)
+                        if lastDayKey == "time":
+                            if util.isTimeFormat(lastDayVal):
+                                lastDaySchedule.time = lastDayVal
+                                hour, minute = util.extractHourAndMinute(lastDayVal)
+                                lastDaySchedule.hour = hour
+                                lastDaySchedule.minute = minute
+                            else:
+                                errMsg = "ERROR: Last Day Of Month time format is not valid! Please use HH:mm format!"
+                                exitWithError(errMsg)
+
+                    conf.lastDayOfMonthSchedule = lastDaySchedule
+
+                if backupKey == "cron" and backupVal is not None:
+                    expressions = backupVal if isinstance(backupVal, list) else [backupVal]
+                    for expression in expressions:
+                        try:
+                            schedules.parseCronExpression(expression)
+                        except ValueError as e:
+                            errMsg = f"ERROR: Cron schedule '{expression}' is not valid ({e})! Please use the 'minute hour day month day_of_week' format!"
+                            exitWithError(errMsg)
+                    conf.cronSchedules = [str(expression) for expression in expressions]
+
+                if backupKey == "catch_up_grace_hours":
+                    if isinstance(backupVal, (int, float)) and backupVal >= 0:
+                        conf.catchUpGraceHours = backupVal
+                    else:
+                        errMsg = "ERROR: Backup schedule catch_up_grace_hours must be zero or a positive number of hours!"
+                        exitWithError(errMsg)
+
+        # Scan Settings
+        if k == "scan_settings" and v is not None:
+            for scanKey, scanVal in v.items():
+                if scanKey in ["concurrency", "host_concurrency"]:
+                    if isinstance(scanVal, int) and scanVal > 0:
+                        if scanKey == "concurrency":
+                            conf.scanConcurrency = scanVal
+                        else:
+                            conf.hostConcurrency = scanVal
+                    else:
+                        errMsg = f"ERROR: Scan {scanKey} must be a positive whole number!"
+                        exitWithError(errMsg)
+                if scanKey == "coalesce_window":
+                    if isinstance(scanVal, (int, float)) and scanVal >= 0:
+                        conf.coalesceSeconds = scanVal
+                    else:
+                        errMsg = "ERROR: Scan coalesce_window must be zero or a positive number of seconds!"
+                        exitWithError(errMsg)
+                if scanKey in ["stagger_window", "max_concurrent_gb"]:
+                    if isinstance(scanVal, (int, float)) and scanVal >= 0:
+                        if scanKey == "stagger_window":
+                            conf.scanStaggerMinutes = scanVal
+                        else:
+                            conf.scanMaxConcurrentGB = scanVal
+                    else:
+                        errMsg = f"ERROR: Scan {scanKey} must be zero or a positive number!"
+                        exitWithError(errMsg)
+                if scanKey == "order":
+                    if str(scanVal).lower() in scanPlanner.ORDERS:
+                        conf.scanOrder = str(scanVal).lower()
+                    else:
+                        errMsg = f"ERROR: Scan order must be one of {scanPlanner.ORDERS}!"
+                        exitWithError(errMsg)
+                if scanKey == "incremental":
+                    conf.incrementalScan = util.safeCastBool(scanVal)
+                if scanKey == "max_age_hours":
+                    if isinstance(scanVal, (int, float)) and scanVal > 0:
+                        conf.incrementalMaxAgeHours = scanVal
+                    else:
+                        errMsg = "ERROR: Scan max_age_hours must be a positive number!"
+                        exitWithError(errMsg)
+                if scanKey == "wait_for_completion":
+                    conf.waitForScanCompletion = util.safeCastBool(scanVal)
+                if scanKey in ["request_timeout", "overall_timeout", "completion_timeout"]:
+                    if isinstance(scanVal, (int, float)) and scanVal > 0:
+                        if scanKey == "request_timeout":
+                            conf.scanRequestTimeout = scanVal
+                        elif scanKey == "overall_timeout":
+                            conf.scanOverallTimeout = scanVal
+                        else:
+                            conf.scanCompletionTimeout = scanVal
+                    else:
+                        errMsg = f"ERROR: Scan {scanKey} must be a positive number of seconds!"
+                        exitWithError(errMsg)
+
+        # Retry Settings
+        if k == "retry_settings" and v is not None:
+            for retryKey, retryVal in v.items():
+                if retryKey == "max_attempts":
+                    if isinstance(retryVal, int) and retryVal >= 0:
+                        conf.retryMaxAttempts = retryVal
+                    else:
+                        errMsg = "ERROR: Retry max_attempts must be zero (no retries) or a positive whole number!"
+                        exitWithError(errMsg)
+                if retryKey == "breaker_threshold":
+                    if isinstance(retryVal, int) and retryVal > 0:
+                        conf.breakerThreshold = retryVal
+                    else:
+                        errMsg = "ERROR: Retry breaker_threshold must be a positive whole number!"
+                        exitWithError(errMsg)
+                if retryKey in ["base_delay", "max_delay", "breaker_cooldown"]:
+                    if isinstance(retryVal, (int, float)) and retryVal > 0:
+                        if retryKey == "base_delay":
+                            conf.retryBaseSeconds = retryVal
+                        elif retryKey == "max_delay":
+                            conf.retryMaxSeconds = retryVal
+                        else:
+                            conf.breakerCooldownMinutes = retryVal
+                    else:
+                        errMsg = f"ERROR: Retry {retryKey} must be a positive number!"
+                        exitWithError(errMsg)
+
+        # History Settings
+        if k == "history_settings" and v is not None:
+            for historyKey, historyVal in v.items():
+                if historyKey in ["retention_days", "max_runs"]:
+                    if isinstance(historyVal, int) and historyVal > 0:
+                        if historyKey == "retention_days":
+                            conf.historyRetentionDays = historyVal
+                        else:
+                            conf.historyMaxRuns = historyVal
+                    else:
+                        errMsg = f"ERROR: History {historyKey} must be a positive whole number!"
+                        exitWithError(errMsg)
+
+        # Coordination between replicas
+        if k == "coordination" and v is not None:
+            for coordKey, coordVal in v.items():
+                if coordKey == "enabled":
+                    conf.coordinationEnabled = util.safeCastBool(coordVal)
+                if coordKey == "node_id" and coordVal is not None:
+                    conf.coordinationNodeId = str(coordVal)
+                if coordKey == "lease_seconds":
+                    if isinstance(coordVal, (int, float)) and coordVal >= 3:
+                        conf.coordinationLeaseSeconds = coordVal
+                    else:
+                        errMsg = "ERROR: Coordination lease_seconds must be a number of at least 3 seconds!"
+                        exitWithError(errMsg)
+
+        # Monitoring of the sync to the remote devices after a run
+        if k == "sync_monitor" and v is not None:
+            for monitorKey, monitorVal in v.items():
+                if monitorKey == "enabled":
+                    conf.syncMonitorEnabled = util.safeCastBool(monitorVal)
+                if monitorKey == "timeout_minutes":
+                    if isinstance(monitorVal, (int, float)) and monitorVal > 0:
+                        conf.syncMonitorTimeoutMinutes = monitorVal
+                    else:
+                        errMsg = "ERROR: Sync monitor timeout_minutes must be a positive number!"
+                        exitWithError(errMsg)
+
+        # Bandwidth limits during the backup window
+        if k == "bandwidth_boost" and v is not None:
+            for boostKey, boostVal in v.items():
+                if boostKey == "enabled":
+                    conf.boostEnabled = util.safeCastBool(boostVal)
+                if boostKey == "devices":
+                    conf.boostDevices = [str(device) for device in boostVal] if boostVal else None
+                if boostKey in ["max_send_kbps", "max_recv_kbps"]:
+                    if isinstance(boostVal, int) and boostVal >= 0:
+                        if boostKey == "max_send_kbps":
+                            conf.boostSendKbps = boostVal
+                        else:
+                            conf.boostRecvKbps = boostVal
+                    else:
+                        errMsg = f"ERROR: Bandwidth boost {boostKey} must be zero (unlimited) or a positive whole number!"
+                        exitWithError(errMsg)
+                if boostKey == "deadline_minutes":
+                    if isinstance(boostVal, (int, float)) and boostVal > 0:
+                        conf.boostDeadlineMinutes = boostVal
+                    else:
+                        errMsg = "ERROR: Bandwidth boost deadline_minutes must be a positive number!"
+                        exitWithError(errMsg)
+
+        if k == "wake_on_lan_settings" and v is not None:
+            for wolKey, wolVal in v.items():
+                if wolKey == "mac_address" and wolVal != "<INSERT YOUR BACKUP PC MAC ADDRESS>":
+                    macAddr = None
+                    try:
+                        # only loaded when wake on lan is configured
+                        import macaddress
+                        macAddr = macaddress.EUI48(wolVal)
+                        macAddr = str(macAddr).replace('-', ':')
+                    except ValueError as error:
+                        exitWithError(f"ERROR: MAC address: {wolVal} is not a valid MAC address!")
+                    conf.WOLMacAddr = macAddr
+                if wolKey == "broadcast_address" and wolVal is not None:
+                    conf.WOLBroadcastAddr = str(wolVal)
+                if wolKey == "use_docker":
+                    conf.WOLUseDocker = util.safeCastBool(wolVal)
+                if wolKey == "probe_host" and wolVal is not None:
+                    conf.WOLProbeHost = str(wolVal)
+                if wolKey in ["port", "repeat", "probe_port", "probe_timeout"]:
+                    if isinstance(wolVal, int) and wolVal > 0:
+                        if wolKey == "port":
+                            conf.WOLPort = wolVal
+                        elif wolKey == "repeat":
+                            conf.WOLRepeat = wolVal
+                        elif wolKey == "probe_port":
+                            conf.WOLProbePort = wolVal
+                        else:
+                            conf.WOLProbeTimeout = wolVal
+                    else:
+                        errMsg = f"ERROR: Wake On Lan {wolKey} must be a positive whole number!"
+                        exitWithError(errMsg)
+
+
+def buildInstances(conf, instanceEntries):
+    """Every entry of the instances list starts as a copy of the top level settings and overrides them with its own
+    sections. Without an instances list, the top level config is the only instance."""
+    if not instanceEntries:
+        return [conf]
+
+    instances = []
+    for entry in instanceEntries:
+        name = entry.get("name") if isinstance(entry, dict) else None
+        if not isinstance(name, str) or re.match(INSTANCE_NAME_PATTERN, name) is None or \
+                any(instance.name == name for instance in instances):
+            errMsg = f"ERROR: Every instance needs a unique name made of letters, numbers, '.', '_' or '-' (got {name})!"
+            exitWithError(errMsg)
+        if name in RESERVED_INSTANCE_NAMES:
+            exitWithError(f"ERROR: The instance name {name} is reserved by the api (/status/{name}) - please rename it!")
+
+        instance = dataclasses.replace(conf, name=name, instances=None)
+        if entry.get("backup_schedule") is not None:
+            # an instance with its own schedule doesn't inherit any of the top level schedules
+            instance.weeklySchedule, instance.dailySchedule, instance.lastDayOfMonthSchedule = None, None, None
+            instance.cronSchedules = None
+        if entry.get("wake_on_lan_settings") is not None:
+            # nor any of the top level wake on lan settings, e.g. the probe host of another machine
+            defaults = {field.name: field.default for field in dataclasses.fields(Config)}
+            for wolField in WOL_FIELDS:
+                setattr(instance, wolField, None if defaults[wolField] is dataclasses.MISSING else defaults[wolField])
+        parseSections(instance, entry)
+        instances.append(instance)
+    return instances
+
+
+def parseConfig():
+    conf = Config(None, None, None, None, None, None, None, None, WOL_R0GGER_IMAGE, None)
+    instanceEntries = []
     try:
-        if path.exists('/yaml/config.yml'):
-            with open('/yaml/config.yml') as f:
-                docs = yaml.load_all(f, Loader=yaml.FullLoader)
+        if path.exists(CONFIG_FILE):
+            with open(CONFIG_FILE, 'rb') as f:
+                content = f.read()
+                contentHash = hashlib.sha256(content).hexdigest()
+                docs = yaml.load_all(content, Loader=yaml.FullLoader)
 
                 for doc in docs:
-                    for k, v in doc.items():
-                        if k == "general_settings" and v is not None:
-                            for generalKey, generalVal in v.items():
-                                if generalKey == "url" and generalVal != "<INSERT YOUR SYNCTHING GUI URL>":
-                                    conf.url = generalVal
-                                if generalKey == "api_key" and generalVal != "<INSERT YOUR SYNCTHING API KEY>":
-                                    conf.apiKey = generalVal
-                                if generalKey == "folders_to_scan":
-                                    conf.foldersToScan = generalVal
-
-                        # Backup Schedule
-                        if k == "backup_schedule" and v is not None:
-                            for backupKey, backupVal in v.items():
-                                if backupKey == "weekly" and backupVal is not None:
-                                    weeklySchedule = ConfSchedule(None, None, None, None)
-                                    for weeklyKey, weeklyVal in backupVal.items():
-                                        if weeklyKey == "day":
-                                            if weeklyVal in ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]:
-                                                weeklySchedule.day = weeklyVal
-                                            else:
-                                                errMsg = "ERROR: Weekly schedule's day is not set properly - Please use MON, TUE, WED, THU, FRI, SAT or SUN to specify the day."
-                                                print(f"{errMsg} Now exiting!")
-                                                sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-                                                sys.exit()
-                                        if weeklyKey == "time":
-                                            if util.isTimeFormat(weeklyVal):
-                                                weeklySchedule.time = weeklyVal
-                                                hour, minute = util.extractHourAndMinute(weeklyVal)
-                                                weeklySchedule.hour = hour
-                                                weeklySchedule.minute = minute
-                                            else:
-                                                errMsg = "ERROR: Weekly time format is not valid! Please use HH:mm format!"
-                                                print(f"{errMsg} Now exiting!")
-                                                sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-                                                sys.exit()
-
-                                    conf.weeklySchedule = weeklySchedule
-
-                                if backupKey == "daily" and backupVal is not None:
-                                    dailySchedule = ConfSchedule(None, None, None, None)
-                                    for dailyKey, dailyVal in backupVal.items():
-                                        if dailyKey == "time":
-                                            if util.isTimeFormat(dailyVal):
-                                                dailySchedule.time = dailyVal
-                                                hour, minute = util.extractHourAndMinute(dailyVal)
-                                                dailySchedule.hour = hour
-                                                dailySchedule.minute = minute
-                                            else:
-                                                errMsg = "ERROR: Daily time format is not valid! Please use HH:mm format!"
-                                                print(f"{errMsg} Now exiting!")
-                                                sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-                                                sys.exit()
-
-                                    conf.dailySchedule = dailySchedule
-
-                                if backupKey == "last_day_of_month" and backupVal is not None:
-                                    lastDaySchedule = ConfSchedule(None, None, None, None)
-                                    for lastDayKey, lastDayVal in backupVal.items():
-                                        if lastDayKey == "day":
-                                            if lastDayVal.upper() in ["MON", "TUE", "WED", "THU", "FRI", "SAT", "SUN"]:
-                                                lastDaySchedule.day = lastDayVal
-                                            else:
-                                                errMsg = "ERROR: Last Day Of Month schedule's day is not set properly - Please use MON, TUE, WED, THU, FRI, SAT or SUN to specify the day."
-                                                print(f"{errMsg} Now exiting!")
-                                                sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-                                                sys.exit()
-                                        if lastDayKey == "time":
-                                            if util.isTimeFormat(lastDayVal):
-                                                lastDaySchedule.time = lastDayVal
-                                                hour, minute = util.extractHourAndMinute(lastDayVal)
-                                                lastDaySchedule.hour = hour
-                                                lastDaySchedule.minute = minute
-                                            else:
-                                                errMsg = "ERROR: Last Day Of Month time format is not valid! Please use HH:mm format!"
-                                                print(f"{errMsg} Now exiting!")
-                                                sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-                                                sys.exit()
-
-                                    conf.lastDayOfMonthSchedule = lastDaySchedule
-
-                        if k == "wake_on_lan_settings" and v is not None:
-                            for wolKey, wolVal in v.items():
-                                if wolKey == "mac_address" and wolVal != "<INSERT YOUR BACKUP PC MAC ADDRESS>":
-                                    macAddr = None
-                                    try:
-                                        macAddr = macaddress.EUI48(wolVal)
-                                        macAddr = str(macAddr).replace('-', ':')
-                                    except ValueError as error:
-                                        print(f"MAC address: {macAddr} is not a valid MAC address! Now exiting!")
-                                        sys.exit()
-                                    conf.WOLMacAddr = macAddr
-
-            env = Env()
-            try:
-                conf.tz = env('TZ')
-            except Exception as e:
+                    parseSections(conf, doc)
+                    if doc.get("instances") is not None:
+                        instanceEntries.extend(doc["instances"])
+
+            conf.tz = os.getenv('TZ')
+            if not conf.tz:
                 errMsg = "ERROR: Timezone is not set in the docker run command/compose. You need to have it set in order for the sync to be executed on time."
-                print(f"{errMsg} Now exiting!")
-                sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-                sys.exit()
+                exitWithError(errMsg)
+
+            conf.instances = buildInstances(conf, instanceEntries)
+            for instance in conf.instances:
+                if not instance.foldersToScan:
+                    instance.allFolders = True
+                else:
+                    instance.allFolders = False
+
+                checkMandatoryFields(instance)
 
-            if not conf.foldersToScan:
-                conf.allFolders = True
-            else:
-                conf.allFolders = False
+            # the host cap is shared by every instance on the same machine, so it is taken from the first one there
+            hostLimits = {}
+            for instance in conf.instances:
+                host = urlparse(instance.url).hostname
+                limit = hostLimits.setdefault(host, instance.hostConcurrency)
+                if instance.hostConcurrency != limit:
+                    print(f"WARNING: {instance.name} shares {host} with an instance listed before it - using its "
+                          f"host_concurrency of {limit} instead of {instance.hostConcurrency}")
+                    instance.hostConcurrency = limit
 
-            checkMandatoryFields()
-            printSetConfig()
-            return conf
+            sqliteDB.set_retention(conf.historyRetentionDays, conf.historyMaxRuns)
+            for instance in conf.instances:
+                printSetConfig(instance)
+            return conf, contentHash
 
         else:
             errMsg = "ERROR: config.yml file not found (please bind the volume that contains the config.yml file)"
-            print(f"{errMsg} - now exiting!")
-            sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-            sys.exit()
+            exitWithError(errMsg)
 
+    except ReloadError:
+        raise
     except Exception as e:
         errMsg = "ERROR: config.yml file is not a valid yml file"
-        print(f"{errMsg} - now exiting!", e)
-        sqliteDB.update_db(500, errMsg, util.getCurrentDateTime())
-        sys.exit()
+        exitWithError(errMsg, e)
@@ -0,0 +1,147 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import configInit
+import metrics
+import syncthingEvents
+
+# hidden env var to set how many events are kept for clients that fall behind or reconnect with Last-Event-ID
+BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+
+# a client that is further behind than this only gets the latest progress event per folder (and device)
+COALESCE_BACKLOG = 50
+
+UPSTREAM_EVENTS = ["StateChanged", "FolderScanProgress", "FolderCompletion", "DeviceConnected", "DeviceDisconnected"]
+UPSTREAM_POLL_SECONDS = 30
+UPSTREAM_RETRY_SECONDS = 10
+# the upstream subscriptions are closed once no client was connected for this long
+UPSTREAM_IDLE_SECONDS = 60
+
+
+@dataclass
+class FeedEvent:
+    id: int
+    # events with the same key supersede each other, so only the latest one is sent to a client that is behind
+    key: tuple
+    # the event is serialized once when it is published, not once per client
+    frame: str
+
+
+class EventFeed:
+    """One ring buffer of events shared by every client, which only keeps a cursor into it. Memory stays the same
+    whatever the number of clients - a client that falls behind the buffer skips the events it missed."""
+
+    def __init__(self, size: int):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=size)
+        self._lastId = 0
+        self.clients = 0
+
+    def publish(self, eventType: str, data: dict, key: tuple = None):
+        with self._cond:
+            self._lastId += 1
+            frame = f"id: {self._lastId}\nevent: {eventType}\ndata: {json.dumps(data)}\n\n"
+            self._events.append(FeedEvent(self._lastId, key, frame))
+            self._cond.notify_all()
+
+    def lastId(self):
+        with self._cond:
+            return self._lastId
+
+    def read(self, cursor: int, timeout: float):
+        """Waits up to timeout for events after the cursor. Returns (events, how many were skipped, the new cursor)."""
+        with self._cond:
+            if cursor > self._lastId:
+                # the client's id is from before a restart - it continues with the new events
+                cursor = self._lastId
+            self._cond.wait_for(lambda: self._lastId > cursor, timeout=timeout)
+            if self._lastId <= cursor:
+                return [], 0, cursor
+            oldest = self._events[0].id
+            events = list(itertools.islice(self._events, max(cursor + 1 - oldest, 0), None))
+            skipped = max(oldest - cursor - 1, 0)
+
+        if len(events) > COALESCE_BACKLOG:
+            latest = {event.key: event.id for event in events if event.key is not None}
+            coalesced = [event for event in events if event.key is None or latest[event.key] == event.id]
+            skipped += len(events) - len(coalesced)
+            events = coalesced
+        return events, skipped, events[-1].id
+
+
+feed = EventFeed(BUFFER_SIZE)
+
+_relays = {}
+_relaysLock = threading.Lock()
+
+
+def coalesceKey(eventType: str, instance: str, data: dict):
+    if eventType == "FolderScanProgress":
+        return eventType, instance, data.get("folder")
+    if eventType == "FolderCompletion":
+        return eventType, instance, data.get("folder"), data.get("device")
+    return None
+
+
+def _relay(instanceName: str):
+    # one long-poll on syncthing's /rest/events per instance, however many clients are connected
+    subscription = None
+    idleSince = None
+    while True:
+        config = configInit.getInstance(instanceName)
+        if config is None:
+            return
+        if feed.clients == 0:
+            idleSince = idleSince or time.monotonic()
+            if time.monotonic() - idleSince > UPSTREAM_IDLE_SECONDS:
+                with _relaysLock:
+                    del _relays[instanceName]
+                return
+        else:
+            idleSince = None
+
+        try:
+            if subscription is None or subscription.url != f"{config.url}/rest/events":
+                subscription = syncthingEvents.EventSubscription(config, UPSTREAM_EVENTS)
+                subscription.start()
+            for event in subscription.poll(UPSTREAM_POLL_SECONDS):
+                data = event.get("data") or {}
+                feed.publish(f"syncthing.{event['type']}", {"instance": instanceName, "time": event.get("time"),
+                                                            "data": data},
+                             coalesceKey(event["type"], instanceName, data))
+        except Exception as e:
+            print(f"Could not follow the Syncthing events of {instanceName} for /events: {e}")
+            subscription = None
+            time.sleep(UPSTREAM_RETRY_SECONDS)
+
+
+def startRelays():
+    """Starts the upstream subscriptions that aren't running yet, e.g. of instances added by a config reload."""
+    with _relaysLock:
+        for instance in configInit.getInstances():
+            relay = _relays.get(instance.name)
+            if relay is None or not relay.is_alive():
+                relay = threading.Thread(target=_relay, args=(instance.name,), name=f"events-{instance.name}",
+                                         daemon=True)
+                relay.start()
+                _relays[instance.name] = relay
+
+
+def connect():
+    """Registers a client and starts the upstream subscriptions."""
+    startRelays()
+    # counted last, so a client that fails to connect is never left counted
+    with _relaysLock:
+        feed.clients += 1
+        metrics.EVENT_CLIENTS.set(feed.clients)
+
+
+def disconnect():
+    with _relaysLock:
+        feed.clients -= 1
+        metrics.EVENT_CLIENTS.set(feed.clients)
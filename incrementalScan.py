@@ -0,0 +1,54 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List
+
+import scanPlanner
+import sqliteDB
+import util
+
+
+@dataclass
+class FolderSelection:
+    toScan: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+
+
+def countersOf(status):
+    # older syncthing versions call the sequence localVersion
+    sequence = status.get("sequence", status.get("localVersion"))
+    return sequence, status.get("globalFiles"), status.get("needBytes")
+
+
+def selectChangedFolders(config, folders):
+    """Queries all folders in one batched pass and keeps only those whose counters moved since their last scan,
+    that were never scanned, or whose last scan is older than config.incrementalMaxAgeHours."""
+    statuses = scanPlanner.fetchFolderStatuses(config, folders)
+    scanPlanner.cacheSizes(config, statuses)
+    stored = sqliteDB.get_folder_states(config.name)
+    maxAgeCutoff = (datetime.now() - timedelta(hours=config.incrementalMaxAgeHours)).strftime('%Y-%m-%d %H:%M:%S')
+
+    selection = FolderSelection()
+    for folder in folders:
+        status = statuses.get(folder)
+        last = stored.get(folder)
+        if status is None or last is None or last.lastScan < maxAgeCutoff or \
+                countersOf(status) != (last.sequence, last.globalFiles, last.needBytes):
+            selection.toScan.append(folder)
+        else:
+            selection.skipped.append(folder)
+    return selection
+
+
+def rememberScannedFolders(config, results):
+    """Stores the counters of the successfully scanned folders as they are after the scan."""
+    scanned = [res.folder for res in results if res.code == 200 and res.folder is not None]
+    if not scanned:
+        return
+
+    now = util.getCurrentDateTime()
+    states = {}
+    for folder, status in scanPlanner.fetchFolderStatuses(config, scanned).items():
+        if status is not None:
+            sequence, globalFiles, needBytes = countersOf(status)
+            states[folder] = sqliteDB.FolderState(sequence, globalFiles, needBytes, now)
+    sqliteDB.save_folder_states(config.name, states)
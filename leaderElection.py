@@ -0,0 +1,80 @@
+import socket
+import threading
+import time
+
+import metrics
+import retryQueue
+import sqliteDB
+import statusSnapshot
+
+LEASE_NAME = "scheduler-leader"
+
+
+class LeaderElector:
+    """Elects one leader among the replicas that share the sqlite database through a lease row. The leader renews
+    the lease on every heartbeat, a follower takes it over once it expired. Only the leader executes runs."""
+
+    def __init__(self, nodeId: str, leaseSeconds: float, onElected=None):
+        self.nodeId = nodeId or socket.gethostname()
+        self.leaseSeconds = leaseSeconds
+        # called after this replica became the leader
+        self.onElected = onElected
+        self._lock = threading.Lock()
+        self._lease = None
+
+    def heartbeat(self):
+        now = time.time()
+        try:
+            lease = sqliteDB.acquire_lease(LEASE_NAME, self.nodeId, self.leaseSeconds, now)
+        except Exception as e:
+            print(f"ERROR: could not renew the leader lease: {e}")
+            return
+
+        with self._lock:
+            wasLeader = self._isLeader(self._lease, now)
+            self._lease = lease
+            isLeader = self._isLeader(lease, now)
+
+        metrics.IS_LEADER.set(1 if isLeader else 0)
+        metrics.LEASE_TERM.set(lease.term)
+        if isLeader and not wasLeader:
+            metrics.LEASE_TRANSITIONS.labels("acquired").inc()
+            if lease.previousRenewedAt is not None:
+                failover = now - lease.previousRenewedAt
+                metrics.FAILOVER_SECONDS.observe(failover)
+                print(f"{self.nodeId} took over as leader (term {lease.term}) {failover:.1f}s after the previous leader's last heartbeat")
+            else:
+                print(f"{self.nodeId} is now the leader (term {lease.term})")
+            if self.onElected is not None:
+                self.onElected()
+        elif wasLeader and not isLeader:
+            metrics.LEASE_TRANSITIONS.labels("lost").inc()
+            print(f"{self.nodeId} lost the leadership to {lease.holder} (term {lease.term})")
+
+        if not isLeader:
+            # followers don't write runs themselves, so their snapshot is refreshed from the shared history
+            for status in sqliteDB.get_latest_per_instance():
+                statusSnapshot.snapshot.publish(status)
+            retryQueue.publishAll()
+
+    def _isLeader(self, lease, now):
+        return lease is not None and lease.holder == self.nodeId and now < lease.expiresAt
+
+    def isLeader(self):
+        # also checks the expiry locally, so a leader whose heartbeats stall stops running before someone takes over
+        with self._lock:
+            return self._isLeader(self._lease, time.time())
+
+    def release(self):
+        if self.isLeader():
+            sqliteDB.release_lease(LEASE_NAME, self.nodeId, time.time())
+            with self._lock:
+                self._lease = None
+            metrics.IS_LEADER.set(0)
+
+
+elector = None
+
+
+def isLeader():
+    return elector is None or elector.isLeader()
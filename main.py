@@ -1,151 +1,455 @@
-import calendar
+import atexit
+import os
+import signal
 import sys
-from datetime import datetime
-
-import docker
-import requests
-from apscheduler.schedulers.background import BackgroundScheduler
+import time
+from datetime import datetime, timedelta
 
+import bandwidthBoost
 import configInit
+import eventFeed
+import incrementalScan
+import leaderElection
+import metrics
+import retryQueue
+import runCoordinator
+import scanDispatcher
+import scanPlanner
+import schedules
 import sqliteDB
 import statusController
+import statusSnapshot
+import syncMonitor
+import syncthingEvents
 import util
-
-
-def runPostRequest(config, dockerClient):
-    header = {"X-API-Key": config.apiKey}
+import wol
+
+# hidden env var to set how often the config file is checked for changes
+CONFIG_WATCH_SECONDS = int(os.getenv("CONFIG_WATCH_SECONDS", "30"))
+
+# job id -> (ScheduleSpec, misfire grace seconds) of the schedules currently registered in the scheduler
+activeSchedules = {}
+
+
+def printScanDurations(results):
+    print("Scan durations per folder:")
+    for res in sorted(results, key=lambda r: r.duration, reverse=True):
+        timeline = ""
+        if res.actualStart is not None and res.plannedStart:
+            timeline = f", planned start +{res.plannedStart:.0f}s, actual start +{res.actualStart:.0f}s"
+        print(f"- {res.folder if res.folder is not None else 'all folders'}: {res.duration:.2f}s (code {res.code}{timeline})")
+
+
+def waitForScanCompletion(config, subscription, folders):
+    # returns an error message if not every folder went back to idle in time, otherwise None
+    if folders is None:
+        folders = syncthingEvents.getFolderIds(config)
+    print(f"Waiting for Syncthing to finish scanning {len(folders)} folder(s)..")
+    waitResult = syncthingEvents.waitForScans(subscription, folders, config.scanCompletionTimeout)
+
+    print("Scan durations reported by Syncthing:")
+    for folder, duration in sorted(waitResult.finished.items(), key=lambda f: f[1] or 0, reverse=True):
+        print(f"- {folder}: {duration:.2f}s" if duration is not None else f"- {folder}: finished")
+
+    if waitResult.failed or waitResult.unfinished:
+        errMsg = f"ERROR: Syncthing did not finish scanning all folders! Failed: {waitResult.failed}, still running after {config.scanCompletionTimeout}s: {waitResult.unfinished}. Please rescan them manually!"
+        return util.fixString(errMsg)
+    return None
+
+
+def wakeBackupPCBeforeScan(config):
+    print(f"Waking up PC on mac address: {config.WOLMacAddr} before scanning..")
+    wol.wakeUp(config)
+    tookSeconds = wol.waitForHost(config.WOLProbeHost, config.WOLProbePort, config.WOLProbeTimeout)
+    if tookSeconds is None:
+        print(f"WARNING: {config.WOLProbeHost}:{config.WOLProbePort} did not come online within {config.WOLProbeTimeout}s - scanning anyway!")
+    else:
+        print(f"{config.WOLProbeHost} is online after {tookSeconds:.1f}s")
+
+
+def wakeBackupPC(config):
+    # returns the message that is printed together with the result of the run
+    if config.WOLMacAddr is None or config.WOLProbeHost is not None:
+        # with a probe host set, the pc was already woken up before the scan
+        return ""
+    wol.wakeUp(config)
+    return f"\nNow waking up PC on mac address: {config.WOLMacAddr}, so it can receive the backup files.."
+
+
+def recordRun(config, code, msg, tsDatetime, results, run):
+    # the trigger names are read when the result is written, so triggers merged during the run are included
+    triggerName = run.triggerName if run is not None else None
+    runId = sqliteDB.record_run(code, msg, tsDatetime, results, triggerName, config.name)
+    if run is not None:
+        run.code, run.runId = code, runId
+    retryQueue.onResults(config, code, results, run.retriedFolders if run is not None else None)
+    eventFeed.feed.publish("run.finished", {
+        "instance": config.name, "trigger": triggerName, "code": code, "msg": msg, "timestamp": tsDatetime,
+        "failedFolders": [res.folder if res.folder is not None else "*" for res in results if res.code != 200]})
+
+    metrics.RUNS.labels(config.name, triggerName or "manual", metrics.resultLabel(code)).inc()
+    for res in results:
+        metrics.FOLDER_SCANS.labels(config.name, res.folder if res.folder is not None else "*", triggerName or "manual",
+                                    metrics.resultLabel(res.code)).inc()
+
+
+def runPostRequest(config, run=None):
     urlToScan = f"{config.url}/rest/db/scan"
     tsDatetime = util.getCurrentDateTime()
+    eventFeed.feed.publish("run.started", {
+        "instance": config.name, "trigger": run.triggerName if run is not None else None, "timestamp": tsDatetime})
+    # kept for the error path, so a failure after the scans (e.g. the wake on lan) doesn't retry scans that succeeded
+    scanned = []
 
     try:
-        if config.allFolders:
+        folders = config.foldersToScan
+        scanAll = config.allFolders
+        if scanAll and (scanPlanner.isEnabled(config) or config.incrementalScan):
+            # the planner and the incremental check work folder by folder, so the folders are listed from syncthing first
+            folders = syncthingEvents.getFolderIds(config)
+            scanAll = False
+
+        skipped = []
+        if config.incrementalScan:
+            selection = incrementalScan.selectChangedFolders(config, folders)
+            folders, skipped = selection.toScan, selection.skipped
+            print(f"Incremental scan: {len(folders)} folder(s) changed or are due, {len(skipped)} scan(s) avoided: {util.fixString(str(skipped))}")
+            if not folders:
+                # nothing to back up, so the backup pc isn't woken up and there is nothing to retry
+                respMsg = f"Nothing changed since the last scans - {len(skipped)} scan(s) avoided."
+                print(respMsg)
+                recordRun(config, 200, respMsg, tsDatetime, [], run)
+                return None
+
+        if config.WOLMacAddr is not None and config.WOLProbeHost is not None:
+            wakeBackupPCBeforeScan(config)
+
+        subscription = None
+        if config.waitForScanCompletion:
+            subscription = syncthingEvents.EventSubscription(config, ["StateChanged", "FolderScanProgress"])
+            subscription.start()
+
+        if scanAll:
             print(
                 f"---------------\nNow running the post request on \'{urlToScan}\' for all folders in the Syncthing service")
-            response = requests.post(urlToScan, headers=header)
-
-            if response.status_code == 200:
+            response = scanDispatcher.dispatchScans(config, [None])[0]
+            scanned = [response]
+            printScanDurations([response])
+
+            if response.code == 200 and subscription is not None:
+                waitErr = waitForScanCompletion(config, subscription, None)
+                if waitErr is not None:
+                    print(waitErr)
+                    recordRun(config, 504, waitErr, tsDatetime, [response], run)
+                    return None
+
+            if response.code == 200:
                 respMsg = "Successfully scanned all folders!"
 
-                wolMsg = ""
-                if config.WOLImage is not None and config.WOLMacAddr is not None:
-                    wolMsg = f"\nNow waking up PC on mac address: {config.WOLMacAddr}, so it can receive the backup files.."
-                    WOLEnvVars = {"MAC": config.WOLMacAddr}
-
-                    dockerClient.containers.run(config.WOLImage, network_mode="host",
-                                                name="WOL-syncthing-scheduler", remove=True,
-                                                environment=WOLEnvVars)
+                wolMsg = wakeBackupPC(config)
 
                 byeMsg = "\nSUCCESS: Backup will commence now! See you at the next scheduled time. ;)"
                 print(respMsg + wolMsg + byeMsg)
-                sqliteDB.update_db(response.status_code, respMsg, tsDatetime)
+                recordRun(config, response.code, respMsg, tsDatetime, [response], run)
             else:
-                respMsg = f"ERROR: While scanning all folders. Code = {response.status_code} with error message = {response.text}! Please rescan it manually!"
+                respMsg = f"ERROR: While scanning all folders. Code = {response.code} with error message = {response.msg}! Please rescan it manually!"
                 respMsg = util.fixString(respMsg)
                 print(respMsg)
-                sqliteDB.update_db(response.status_code, respMsg, tsDatetime)
+                recordRun(config, response.code, respMsg, tsDatetime, [response], run)
 
         else:
             print(
-                f"---------------\nNow running the post request for scanning the following folders in syncthing service: {util.fixString(str(config.foldersToScan))}")
-            responses = []
-            for folder in config.foldersToScan:
-                folderToScan = f"{urlToScan}/?folder={folder}"
-                responses.append(requests.post(folderToScan, headers=header))
+                f"---------------\nNow running the post request for scanning the following folders in syncthing service: {util.fixString(str(folders))}")
+            if scanPlanner.isEnabled(config):
+                plan = scanPlanner.planScans(config, folders)
+                print(f"Planned scan order: {[item.folder for item in plan]}")
+                responses = scanDispatcher.dispatchPlan(config, plan, scanPlanner.maxConcurrentBytes(config))
+            else:
+                responses = scanDispatcher.dispatchScans(config, folders)
+            scanned = responses
+            printScanDurations(responses)
+            if config.incrementalScan:
+                incrementalScan.rememberScannedFolders(config, responses)
 
-            hasFailed = any(resp.status_code != 200 for resp in responses)
+            hasFailed = any(resp.code != 200 for resp in responses)
             failedFolders = []
             if hasFailed:
-                onlyFailed = (res for res in responses if res.status_code != 200)
+                onlyFailed = (res for res in responses if res.code != 200)
+                print("Error: The following requests have failed:")
                 for res in onlyFailed:
-                    failedFolders.append(res.request.url.split("=")[-1])
-                    print("Error: The following requests have failed:")
+                    failedFolders.append(res.folder)
                     print(
-                        f"- Called URL: {res.request.url}. RESPONSE CODE: {res.status_code} and error msg: {res.text}")
+                        f"- Folder: {res.folder}. RESPONSE CODE: {res.code} and error msg: {res.msg}")
 
                 respMsg = f"ERROR: while scanning multiple folders {failedFolders}: Please rescan them manually!"
                 respMsg = util.fixString(respMsg)
                 print(respMsg)
-                sqliteDB.update_db(500, respMsg, tsDatetime)
+                recordRun(config, 500, respMsg, tsDatetime, responses, run)
             else:
-                respMsg = f"Successfully scanned all selected folders: {config.foldersToScan}."
+                if subscription is not None:
+                    waitErr = waitForScanCompletion(config, subscription, folders)
+                    if waitErr is not None:
+                        print(waitErr)
+                        recordRun(config, 504, waitErr, tsDatetime, responses, run)
+                        return None
+
+                respMsg = f"Successfully scanned all selected folders: {folders}."
+                if config.incrementalScan:
+                    respMsg += f" {len(skipped)} unchanged folder(s) were skipped."
                 respMsg = util.fixString(respMsg)
 
-                wolMsg = ""
-                if config.WOLImage is not None and config.WOLMacAddr is not None:
-                    wolMsg = f"\nNow waking up PC on mac address: {config.WOLMacAddr}, so it can receive the backup files.."
-                    WOLEnvVars = {"MAC": config.WOLMacAddr}
-
-                    dockerClient.containers.run(config.WOLImage, network_mode="host",
-                                                name="WOL-syncthing-scheduler", remove=True,
-                                                environment=WOLEnvVars)
+                wolMsg = wakeBackupPC(config)
 
                 byeMsg = "\nSUCCESS: Backup will commence now! See you at the next scheduled time. ;)"
                 print(respMsg + wolMsg + byeMsg)
-                sqliteDB.update_db(200, respMsg, tsDatetime)
+                recordRun(config, 200, respMsg, tsDatetime, responses, run)
 
-    except requests.exceptions.Timeout:
-        strErr = f"ERROR: Timeout has occurred while calling scanning folder(s)! Please run the scan manually!"
-        print(strErr)
-        sqliteDB.update_db(408, strErr, tsDatetime)
-        return None
     except Exception as e:
         strErr = f"ERROR: {str(e)} has occurred while calling folders to scan! Please run the scan manually!"
         respMsg = util.fixString(strErr)
         print(respMsg)
-        sqliteDB.update_db(500, respMsg, tsDatetime)
+        recordRun(config, 500, respMsg, tsDatetime, scanned, run)
         return None
 
 
-def mainLastDayOfMonth(dockerClient):
-    # check to see if it is in fact the last day of the month - and if so, then allow the schedule to take place
-    today = datetime.today()
-    curDay = today.day
-    daysInCurMonth = calendar.monthrange(today.year, today.month)[1]
-
-    if (daysInCurMonth - 7) < curDay:
-        startMainProcess(dockerClient)
-
-
-def startMainProcess(dockerClient):
-    print("---------------\nCOMMENCING THE SCHEDULED TASK TO PING SYNCTHING FOR BACKUP..\n")
-    config = configInit.initConfig()
-    runPostRequest(config, dockerClient)
+def startMainProcess(instanceName, triggerName):
+    if not leaderElection.isLeader():
+        print(f"This replica is not the leader - leaving the {triggerName} trigger of {instanceName} to the leader")
+        return
+    config = configInit.getInstance(instanceName)
+    if config is None:
+        print(f"The {instanceName} instance is no longer configured - skipping its {triggerName} trigger")
+        return
+    runCoordinator.coordinator.trigger(instanceName, triggerName, config.coalesceSeconds, executeRun)
+
+
+def startRetry(instanceName, folders):
+    # folders is None when the whole run is retried
+    config = configInit.getInstance(instanceName)
+    if config is None or not leaderElection.isLeader():
+        return
+
+    def runRetry(run):
+        run.retriedFolders = folders or [retryQueue.ALL_FOLDERS]
+        print(f"---------------\nRETRYING THE FAILED SCANS OF {config.name}: {folders or 'all folders'}\n")
+        runPostRequest(retryQueue.retryConfig(config, folders), run)
+
+    # a retry that finds a run of the instance in flight is merged into it, as that run scans the folders anyway. It is
+    # a partial run itself, so a scheduled trigger waits for it rather than being merged into the (smaller) retry
+    runCoordinator.coordinator.trigger(instanceName, "retry", 0, runRetry, partial=True)
+
+
+def executeRun(run):
+    # read the config after the coalescing window, so an edit made in the meantime is already used
+    config = configInit.getInstance(run.target)
+    if config is None:
+        return
+    instanceMsg = f" FOR {config.name}" if config.name != configInit.DEFAULT_INSTANCE else ""
+    print(f"---------------\nCOMMENCING THE SCHEDULED TASK ({run.triggerName}){instanceMsg} TO PING SYNCTHING FOR BACKUP..\n")
+    start = time.monotonic()
+    if config.boostEnabled:
+        try:
+            bandwidthBoost.boost(config)
+        except Exception as e:
+            print(f"WARNING: could not raise the bandwidth limits ({e}) - the backup runs with the current ones")
+    try:
+        runPostRequest(config, run)
+    finally:
+        if config.boostEnabled:
+            bandwidthBoost.restoreWhenDone(config)
+    metrics.RUN_SECONDS.labels(config.name, run.triggerName).observe(time.monotonic() - start)
+
+    if config.syncMonitorEnabled and run.code == 200:
+        syncMonitor.monitorInBackground(config, None if config.allFolders else config.foldersToScan, run.runId)
+
+
+class StartupTimer:
+    """Times the phases of the startup, which are printed and exported as metrics once it is done."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = {}
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.phases[name] = now - self.last
+        self.last = now
+        metrics.STARTUP_SECONDS.labels(name).set(self.phases[name])
+
+    def report(self):
+        phases = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.phases.items())
+        print(f"Started in {self.last - self.start:.3f}s ({phases})")
+
+
+def onJobEvent(event):
+    from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+    if event.code == EVENT_JOB_MISSED:
+        if event.job_id not in activeSchedules:
+            # internal jobs (config watcher, lease heartbeat, retries) just run late, e.g. after the host slept
+            return
+        metrics.MISSED_RUNS.labels(event.job_id).inc()
+        print(f"WARNING: the {event.job_id} schedule missed its run time of {event.scheduled_run_time}!")
+    elif event.code == EVENT_JOB_SUBMITTED:
+        for scheduledTime in event.scheduled_run_times:
+            lag = (datetime.now(scheduledTime.tzinfo) - scheduledTime).total_seconds()
+            metrics.SCHEDULER_LAG_SECONDS.labels(event.job_id).observe(max(lag, 0))
+        if event.job_id in activeSchedules and leaderElection.isLeader():
+            sqliteDB.save_schedule_run(event.job_id, max(event.scheduled_run_times))
+
+
+def missedFireTimes(spec, lastFired, now, graceSeconds):
+    """Returns (the latest fire time of the schedule after lastFired that is at most graceSeconds old, the first fire
+    time after lastFired if it is older than that), either can be None. Only the fire times inside the grace window
+    are walked through, so a long downtime doesn't make the startup slower."""
+    trigger = schedules.buildTrigger(spec, now.tzinfo)
+    windowStart = max(lastFired, now - timedelta(seconds=graceSeconds))
+
+    # the cron fields have a one minute resolution, so stepping a second past a fire time finds the next one
+    expired = trigger.get_next_fire_time(None, lastFired + timedelta(seconds=1))
+    if expired is not None and expired >= windowStart:
+        expired = None
+
+    latest = None
+    fireTime = trigger.get_next_fire_time(None, max(windowStart, lastFired + timedelta(seconds=1)))
+    while fireTime is not None and fireTime <= now:
+        latest = fireTime
+        fireTime = trigger.get_next_fire_time(fireTime, fireTime + timedelta(seconds=1))
+    return latest, expired
+
+
+def onBecameLeader(scheduler, config):
+    # whatever the previous leader (or this scheduler before a restart) left unfinished is taken care of
+    bandwidthBoost.restorePending()
+    retryQueue.rescheduleStored()
+    catchUpMissedRuns(scheduler, config)
+
+
+def catchUpMissedRuns(scheduler, config):
+    """Submits every schedule that should have fired while no scheduler (or no leader) was running, at most once per
+    schedule and only within its grace window. The runs of one instance are merged by the run coordinator."""
+    if not leaderElection.isLeader():
+        return
+    lastFiredTimes = sqliteDB.get_schedule_runs()
+    now = datetime.now(scheduler.timezone)
+    for jobId, spec in schedules.scheduleSpecs(config).items():
+        lastFired = lastFiredTimes.get(jobId)
+        if lastFired is None:
+            # nothing to catch up on for a new schedule - it is tracked from now on
+            sqliteDB.save_schedule_run(jobId, now)
+            continue
+        instance = configInit.getInstance(spec.instance)
+        missed, expired = missedFireTimes(spec, lastFired, now, instance.catchUpGraceHours * 3600)
+        if expired is not None and missed is None:
+            metrics.MISSED_RUNS.labels(jobId).inc()
+            print(f"WARNING: the {jobId} schedule was due at {expired} while the scheduler was down - that is longer "
+                  f"ago than {instance.catchUpGraceHours} hours (backup_schedule.catch_up_grace_hours), so it is skipped!")
+            sqliteDB.save_schedule_run(jobId, now)
+        if missed is None:
+            continue
+
+        metrics.MISSED_RUNS.labels(jobId).inc()
+        print(f"The {jobId} schedule was missed at {missed} - running it now")
+        sqliteDB.save_schedule_run(jobId, missed)
+        scheduler.add_job(startMainProcess, trigger='date', id=f"{jobId}:catchUp", replace_existing=True,
+                          args=[spec.instance, f"{spec.trigger}-catchup"], misfire_grace_time=None)
+
+
+def applySchedules(scheduler, config):
+    """Diffs the wanted schedules against the registered jobs and only adds, reschedules or removes what changed."""
+    wanted = schedules.scheduleSpecs(config)
+    statusSnapshot.snapshot.retain([instance.name for instance in config.instances] + [sqliteDB.SCHEDULER_INSTANCE])
+
+    for jobId, spec in wanted.items():
+        # a fire time missed while the scheduler was running (e.g. the host was suspended) is still run once
+        # within the grace window, like the ones missed while it was down
+        graceSeconds = max(configInit.getInstance(spec.instance).catchUpGraceHours * 3600, 1)
+        current = activeSchedules.get(jobId)
+        if current is None:
+            scheduler.add_job(startMainProcess, trigger=schedules.buildTrigger(spec, scheduler.timezone), id=jobId,
+                              args=[spec.instance, spec.trigger], coalesce=True, misfire_grace_time=graceSeconds)
+            print(f"Added the {jobId} schedule")
+        elif current != (spec, graceSeconds):
+            scheduler.reschedule_job(jobId, trigger=schedules.buildTrigger(spec, scheduler.timezone))
+            scheduler.modify_job(jobId, misfire_grace_time=graceSeconds)
+            print(f"Rescheduled the {jobId} schedule")
+        activeSchedules[jobId] = (spec, graceSeconds)
+
+    for jobId in list(activeSchedules):
+        if jobId not in wanted:
+            scheduler.remove_job(jobId)
+            del activeSchedules[jobId]
+            print(f"Removed the {jobId} schedule")
+
+
+def reloadConfig(scheduler):
+    config = configInit.reloadIfChanged()
+    if config is not None:
+        applySchedules(scheduler, config)
+        sqliteDB.update_db(200, "Config reloaded - waiting for the next checks", util.getCurrentDateTime())
+
+
+def stop(scheduler):
+    # docker stop sends SIGTERM. A plain exit would first wait for the running jobs (and their scans) and only then run
+    # the atexit handlers, so the lease is released right away and the scheduler doesn't start anything new
+    print("Stopping - releasing the leader lease..")
+    leaderElection.elector.release()
+    scheduler.shutdown(wait=False)
+    sys.exit(0)
 
 
 def main():
+    timer = StartupTimer()
     print("STARTING SCRIPT!")
 
     # initialize the db
     print("Initializing sqlite database..")
-    sqliteDB.init_db(r"/sqldb/nova.db")
+    sqliteDB.init_db(sqliteDB.DB_FILE)
+    timer.phase("sqlite")
 
-    print("Connecting with docker server..")
-    try:
-        dockerClient = docker.DockerClient(base_url='unix://var/run/docker.sock')
-    except Exception as e:
-        print("ERROR: cannot find docker server! now exiting!")
-        sys.exit(0)
+    # /status is served right away (from the last statuses in the history), so health checks pass while booting
+    apiThread = statusController.startApi()
+    timer.phase("api")
 
     config = configInit.initConfig()
-
-    scheduler = BackgroundScheduler({'apscheduler.timezone': config.tz})
-
-    if config.dailySchedule is not None:
-        scheduler.add_job(lambda: startMainProcess(dockerClient), trigger='cron', minute=config.dailySchedule.minute,
-                          hour=config.dailySchedule.hour, day='*', month='*', day_of_week='*')
-    if config.weeklySchedule is not None:
-        scheduler.add_job(lambda: startMainProcess(dockerClient), trigger='cron', minute=config.weeklySchedule.minute,
-                          hour=config.weeklySchedule.hour, day='*', month='*',
-                          day_of_week=config.weeklySchedule.day.lower())
-    if config.lastDayOfMonthSchedule is not None:
-        scheduler.add_job(lambda: mainLastDayOfMonth(dockerClient), trigger='cron',
-                          minute=config.lastDayOfMonthSchedule.minute,
-                          hour=config.lastDayOfMonthSchedule.hour, day='*', month='*',
-                          day_of_week=config.lastDayOfMonthSchedule.day.lower())
+    timer.phase("config")
+
+    # apscheduler is only loaded now, after /status is up
+    from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    # all instances share one executor - runs of different instances are limited per host by the scan dispatcher
+    scheduler = BackgroundScheduler({'apscheduler.timezone': config.tz,
+                                     'apscheduler.executors.default': {
+                                         'class': 'apscheduler.executors.pool:ThreadPoolExecutor',
+                                         'max_workers': str(max(10, 2 * len(config.instances) + 2))}})
+    scheduler.add_listener(onJobEvent, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+    applySchedules(scheduler, config)
+    scheduler.add_job(lambda: reloadConfig(scheduler), trigger='interval', id="configWatcher",
+                      seconds=CONFIG_WATCH_SECONDS)
+    retryQueue.start(scheduler, startRetry)
 
     scheduler.start()
-
-    statusController.runApi()
-
-
-main()
+    timer.phase("scheduler")
+
+    if config.coordinationEnabled:
+        # changing the coordination settings needs a restart. Whichever replica becomes the leader catches up on
+        # the runs that were missed before it took over
+        leaderElection.elector = leaderElection.LeaderElector(
+            config.coordinationNodeId, config.coordinationLeaseSeconds,
+            onElected=lambda: onBecameLeader(scheduler, configInit.getConfig()))
+        leaderElection.elector.heartbeat()
+        scheduler.add_job(leaderElection.elector.heartbeat, trigger='interval', id="leaseHeartbeat",
+                          seconds=config.coordinationLeaseSeconds / 3)
+        atexit.register(leaderElection.elector.release)
+        signal.signal(signal.SIGTERM, lambda *_: stop(scheduler))
+    else:
+        onBecameLeader(scheduler, config)
+    timer.phase("leadership")
+    timer.report()
+
+    apiThread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# scans and runs can take from milliseconds up to hours, so the buckets reach far
+LONG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, float("inf"))
+SHORT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, float("inf"))
+
+SCAN_REQUEST_SECONDS = Histogram("syncthing_scheduler_scan_request_seconds",
+                                 "Latency of the /rest/db/scan request per folder", ["instance", "folder"],
+                                 buckets=LONG_BUCKETS)
+RUN_SECONDS = Histogram("syncthing_scheduler_run_seconds", "End-to-end duration of a scheduled run",
+                        ["instance", "trigger"], buckets=LONG_BUCKETS)
+SQLITE_WRITE_SECONDS = Histogram("syncthing_scheduler_sqlite_write_seconds",
+                                 "Duration of writing a run and its folder results to sqlite", buckets=SHORT_BUCKETS)
+WOL_SECONDS = Histogram("syncthing_scheduler_wol_seconds", "Duration of sending the Wake-on-LAN packet",
+                        ["method"], buckets=LONG_BUCKETS)
+SCHEDULER_LAG_SECONDS = Histogram("syncthing_scheduler_lag_seconds",
+                                  "Delay between a job's scheduled fire time and its actual submission", ["job"],
+                                  buckets=SHORT_BUCKETS[:-1] + (2.5, 5, 10, 30, 60, float("inf")))
+MISSED_RUNS = Counter("syncthing_scheduler_missed_runs_total", "Scheduled fire times that were missed", ["job"])
+COALESCED_RUNS = Counter("syncthing_scheduler_coalesced_runs_total",
+                         "Triggers that were merged into an already pending or running run", ["trigger"])
+RUNS = Counter("syncthing_scheduler_runs_total", "Finished runs by instance, trigger and result",
+               ["instance", "trigger", "result"])
+FOLDER_SCANS = Counter("syncthing_scheduler_folder_scans_total", "Folder scans by instance, folder, trigger and result",
+                       ["instance", "folder", "trigger", "result"])
+IS_LEADER = Gauge("syncthing_scheduler_is_leader", "1 if this replica holds the leader lease")
+LEASE_TERM = Gauge("syncthing_scheduler_lease_term", "Term of the leader lease as last seen by this replica")
+LEASE_TRANSITIONS = Counter("syncthing_scheduler_lease_transitions_total",
+                            "Times this replica acquired or lost the leader lease", ["transition"])
+FAILOVER_SECONDS = Histogram("syncthing_scheduler_failover_seconds",
+                             "Time between the previous leader's last heartbeat and this replica taking over",
+                             buckets=(5, 10, 15, 30, 45, 60, 90, 120, 300, float("inf")))
+
+SYNC_MB_PER_SECOND = Gauge("syncthing_scheduler_sync_mb_per_second",
+                           "Effective throughput of the last completed sync to a remote device", ["instance", "device"])
+SYNC_COMPLETE_SECONDS = Histogram("syncthing_scheduler_sync_complete_seconds",
+                                  "Time from the end of a run until a remote device reached 100% for a folder",
+                                  ["instance", "device"], buckets=LONG_BUCKETS[:-1] + (14400, 28800, float("inf")))
+
+RETRIES = Counter("syncthing_scheduler_retries_total", "Folder retries that were scheduled", ["instance"])
+BREAKER_OPENINGS = Counter("syncthing_scheduler_circuit_breaker_openings_total",
+                           "Times a circuit breaker opened after too many consecutive failures", ["instance", "folder"])
+
+EVENT_CLIENTS = Gauge("syncthing_scheduler_event_clients", "Clients connected to the /events stream")
+SKIPPED_EVENTS = Counter("syncthing_scheduler_skipped_events_total",
+                         "Events not sent to a slow /events client because they were dropped or superseded")
+
+STARTUP_SECONDS = Gauge("syncthing_scheduler_startup_seconds", "Duration of each phase of the last startup", ["phase"])
+
+
+def resultLabel(code: int):
+    return "success" if code == 200 else "failure"
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
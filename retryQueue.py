@@ -0,0 +1,185 @@
+import dataclasses
+import random
+import threading
+import time
+from datetime import datetime
+
+import configInit
+import eventFeed
+import leaderElection
+import metrics
+import sqliteDB
+import statusSnapshot
+
+# retry state key of the instance as a whole - like in FOLDER_RESULTS, where a scan of all folders is stored as "*"
+ALL_FOLDERS = "*"
+
+# failures that can go away by themselves - others (e.g. 403 for a wrong api key, 404 for an unknown folder) can't
+RETRYABLE_CODES = [408, 429]
+
+_lock = threading.RLock()
+_scheduler = None
+_runFolders = None
+
+
+def start(scheduler, runFolders):
+    """Lets the queue add its one-shot retry jobs to the scheduler. runFolders(instanceName, folders) runs a retry of
+    the folders (None for the whole run). The stored retries are only scheduled by the leader, see rescheduleStored."""
+    global _scheduler, _runFolders
+    _scheduler, _runFolders = scheduler, runFolders
+    publishAll()
+
+
+def rescheduleStored():
+    # called when this replica becomes the leader - the retry jobs of the previous leader (or of this one before a
+    # restart) only existed in its own scheduler. Retries that are already due run right away
+    for instance in sorted({state.instance for state in sqliteDB.get_retry_states()}):
+        if configInit.getInstance(instance) is not None:
+            publish(instance)
+            schedule(instance)
+
+
+def isRetryable(code: int):
+    return code in RETRYABLE_CODES or code >= 500
+
+
+def backoffSeconds(config, attempt: int):
+    delay = min(config.retryBaseSeconds * 2 ** (attempt - 1), config.retryMaxSeconds)
+    # "equal jitter" - folders (and instances) that failed together don't all retry at the same moment
+    return delay / 2 + random.random() * delay / 2
+
+
+def isOpen(state, now: float):
+    return state.openUntil is not None and now < state.openUntil
+
+
+def onResults(config, code, results, retriedFolders=None):
+    """Updates the retry state of the instance with the code and ScanResults of a run and schedules the retries.
+    retriedFolders is set when the run was itself a retry, then the attempts go on counting instead of starting over."""
+    if _scheduler is None or config.retryMaxAttempts == 0:
+        return
+    if not results and code == 200:
+        # nothing needed a scan, e.g. an incremental run without changes - there is nothing to retry
+        return
+    now = time.time()
+    with _lock:
+        states = {s.folder: s for s in sqliteDB.get_retry_states(config.name)}
+        keyed = [(r.folder if r.folder is not None else ALL_FOLDERS, r) for r in results]
+        if not keyed:
+            # the run failed before any folder was scanned
+            keyed = [(folder, None) for folder in retriedFolders or [ALL_FOLDERS]]
+
+        cleared = [folder for folder, res in keyed if res is not None and res.code == 200]
+        failed = [(folder, res) for folder, res in keyed if res is None or res.code != 200]
+        wholeRun = states.get(ALL_FOLDERS) or sqliteDB.RetryState(config.name, ALL_FOLDERS, 0, 0)
+        if cleared:
+            # the host answers again, so its breaker is closed
+            cleared.append(ALL_FOLDERS)
+            wholeRun = sqliteDB.RetryState(config.name, ALL_FOLDERS, 0, 0)
+        else:
+            # nothing succeeded - the host itself is counted as failing too
+            wholeRun.failures += 1
+            wholeRun.lastError = failed[0][1].msg if failed and failed[0][1] is not None else "the run failed"
+            _openIfTripped(config, wholeRun, now)
+            if not any(folder == ALL_FOLDERS for folder, _ in failed):
+                states[ALL_FOLDERS] = wholeRun
+
+        for folder, res in failed:
+            state = wholeRun if folder == ALL_FOLDERS else \
+                states.get(folder) or sqliteDB.RetryState(config.name, folder, 0, 0)
+            if folder != ALL_FOLDERS:
+                state.failures += 1
+                state.lastError = res.msg if res is not None else "the run failed"
+            if retriedFolders is None:
+                state.attempt = 0
+            state.nextRetryAt = None
+            if (res is None or isRetryable(res.code)) and not _openIfTripped(config, state, now) and \
+                    not isOpen(wholeRun, now) and state.attempt < config.retryMaxAttempts:
+                state.attempt += 1
+                state.nextRetryAt = now + backoffSeconds(config, state.attempt)
+                metrics.RETRIES.labels(config.name).inc()
+                print(f"Retrying {folder} of {config.name} in {state.nextRetryAt - now:.0f}s (attempt {state.attempt}/{config.retryMaxAttempts})")
+                eventFeed.feed.publish("retry.scheduled", {
+                    "instance": config.name, "folder": folder, "attempt": state.attempt,
+                    "nextRetry": datetime.fromtimestamp(state.nextRetryAt).strftime('%Y-%m-%d %H:%M:%S')})
+            states[folder] = state
+
+        if isOpen(wholeRun, now):
+            # no retries against a host that keeps failing - the next scheduled run tries again
+            for state in states.values():
+                state.nextRetryAt = None
+        sqliteDB.save_retry_states(config.name, [s for f, s in states.items() if f not in cleared], cleared)
+        publish(config.name)
+        schedule(config.name)
+
+
+def _openIfTripped(config, state, now: float):
+    # returns whether the breaker of the state is open, opening it if the failures just reached the threshold
+    if state.failures >= config.breakerThreshold and not isOpen(state, now):
+        state.openUntil = now + config.breakerCooldownMinutes * 60
+        state.attempt = 0
+        metrics.BREAKER_OPENINGS.labels(config.name, state.folder).inc()
+        target = "all folders" if state.folder == ALL_FOLDERS else state.folder
+        print(f"WARNING: {target} of {config.name} failed {state.failures} times in a row - no retries for "
+              f"{config.breakerCooldownMinutes} minutes!")
+    return isOpen(state, now)
+
+
+def publish(instance: str):
+    now = time.time()
+    retries = []
+    for state in sqliteDB.get_retry_states(instance):
+        if state.nextRetryAt is None and not isOpen(state, now):
+            # failed, but neither queued nor blocked - it waits for the next scheduled run
+            continue
+        entry = {"folder": state.folder, "failures": state.failures, "attempt": state.attempt,
+                 "lastError": state.lastError, "breakerOpen": isOpen(state, now)}
+        if state.nextRetryAt is not None:
+            entry["nextRetry"] = datetime.fromtimestamp(state.nextRetryAt).strftime('%Y-%m-%d %H:%M:%S')
+        if isOpen(state, now):
+            entry["breakerOpenUntil"] = datetime.fromtimestamp(state.openUntil).strftime('%Y-%m-%d %H:%M:%S')
+        retries.append(entry)
+    statusSnapshot.snapshot.publishRetries(instance, retries)
+
+
+def publishAll():
+    # followers don't change the retry state themselves, so they refresh it from the shared database
+    for instance in configInit.getInstances():
+        publish(instance.name)
+
+
+def schedule(instance: str):
+    # one one-shot job per instance at its earliest retry - the folders that are due by then are retried together
+    pending = [s.nextRetryAt for s in sqliteDB.get_retry_states(instance) if s.nextRetryAt is not None]
+    jobId = f"{instance}:retry"
+    if not pending:
+        if _scheduler.get_job(jobId) is not None:
+            _scheduler.remove_job(jobId)
+        return
+    _scheduler.add_job(runDue, trigger='date', id=jobId, replace_existing=True, args=[instance],
+                       run_date=datetime.fromtimestamp(min(pending), _scheduler.timezone), misfire_grace_time=None)
+
+
+def runDue(instance: str):
+    if not leaderElection.isLeader():
+        # the retries are left in the shared database for the leader
+        return
+    with _lock:
+        now = time.time()
+        due = [s for s in sqliteDB.get_retry_states(instance) if s.nextRetryAt is not None and s.nextRetryAt <= now + 1]
+        for state in due:
+            state.nextRetryAt = None
+        sqliteDB.save_retry_states(instance, due, [])
+    if not due:
+        schedule(instance)
+        return
+    folders = [s.folder for s in due]
+    publish(instance)
+    _runFolders(instance, None if ALL_FOLDERS in folders else folders)
+
+
+def retryConfig(config, folders):
+    # the incremental check would skip the folders again, as their counters didn't move since the failed scan
+    if folders is None:
+        return dataclasses.replace(config, incrementalScan=False)
+    return dataclasses.replace(config, foldersToScan=folders, allFolders=False, incrementalScan=False)
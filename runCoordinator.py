@@ -0,0 +1,83 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import metrics
+import util
+
+
+@dataclass
+class CoordinatedRun:
+    target: str
+    triggers: List[str] = field(default_factory=list)
+    startedAt: str = None
+    finishedAt: str = None
+    # result of the run once it was recorded
+    code: int = None
+    runId: int = None
+    # the folders a retry run was limited to, None for scheduled runs
+    retriedFolders: List[str] = None
+    # a partial run (a retry) only does part of the work, so other triggers wait for it instead of being merged into it
+    partial: bool = False
+
+    @property
+    def triggerName(self):
+        return "+".join(self.triggers)
+
+
+class RunCoordinator:
+    """Single-flight runs per target: the first trigger opens a coalescing window and runs the pipeline once the window
+    closes, every trigger that arrives during the window or while that run is still in flight is merged into it.
+    A partial run is never merged into - triggers that arrive during it wait until it finished."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._running = {}
+        self.lastRuns = {}
+        self.coalescedCount = 0
+
+    def trigger(self, target: str, triggerName: str, coalesceSeconds: float, runFunc, partial: bool = False):
+        """Runs runFunc(run) for the target, unless a run is already pending or in flight for it.
+        Returns the CoordinatedRun when this call executed it, or None when the trigger was merged into another run."""
+        with self._cond:
+            while True:
+                existing = self._pending.get(target) or self._running.get(target)
+                if existing is None:
+                    break
+                if not existing.partial:
+                    existing.triggers.append(triggerName)
+                    self.coalescedCount += 1
+                    metrics.COALESCED_RUNS.labels(triggerName).inc()
+                    print(f"The {triggerName} trigger was merged into the already started run ({existing.triggerName}) for {target}")
+                    return None
+                print(f"The {triggerName} trigger waits for the {existing.triggerName} run of {target} to finish")
+                self._cond.wait()
+
+            run = CoordinatedRun(target, [triggerName], partial=partial)
+            self._pending[target] = run
+
+        if coalesceSeconds > 0:
+            time.sleep(coalesceSeconds)
+
+        with self._cond:
+            del self._pending[target]
+            self._running[target] = run
+            run.startedAt = util.getCurrentDateTime()
+        try:
+            runFunc(run)
+        finally:
+            with self._cond:
+                del self._running[target]
+                run.finishedAt = util.getCurrentDateTime()
+                self.lastRuns[target] = run
+                self._cond.notify_all()
+        return run
+
+    def inFlight(self):
+        with self._cond:
+            return {target: list(run.triggers) for target, run in {**self._pending, **self._running}.items()}
+
+
+coordinator = RunCoordinator()
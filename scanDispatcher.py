@@ -0,0 +1,159 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import metrics
+
+_sessions = {}
+_sessionsLock = threading.Lock()
+_hostSlots = {}
+
+
+@dataclass
+class ScanResult:
+    folder: str
+    code: int
+    msg: str
+    duration: float
+    plannedStart: float = None
+    actualStart: float = None
+    sizeBytes: int = None
+
+
+@dataclass
+class PlannedScan:
+    folder: str
+    sizeBytes: int = None
+    files: int = None
+    # seconds after the start of the run at which the scan should be sent at the earliest
+    plannedStart: float = 0
+
+
+def newSession(poolSize: int):
+    # requests is only loaded once the first run needs it, so it doesn't slow down the startup
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(poolSize, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def getSession(baseUrl: str, poolSize: int):
+    # one keep-alive session per syncthing host, so repeated scans reuse the same connections. A new pool size (e.g.
+    # after a config reload) gets a new session - requests still running on the old one just finish there
+    with _sessionsLock:
+        cached = _sessions.get(baseUrl)
+        if cached is None or cached[0] != poolSize:
+            cached = (poolSize, newSession(poolSize))
+            _sessions[baseUrl] = cached
+        return cached[1]
+
+
+def getHostSlots(baseUrl: str, hostConcurrency: int):
+    """Caps the scans running against one machine across all instances and runs, e.g. several syncthings on one NAS.
+    The config gives every instance on a host the host_concurrency of the first one there, so the limit only changes
+    when that one is reloaded - the scans holding a slot of the old limit still count against it until they finish."""
+    host = urlparse(baseUrl).hostname
+    with _sessionsLock:
+        cached = _hostSlots.get(host)
+        if cached is None or cached[0] != hostConcurrency:
+            cached = (hostConcurrency, threading.BoundedSemaphore(max(hostConcurrency, 1)))
+            _hostSlots[host] = cached
+        return cached[1]
+
+
+def scanFolder(session, urlToScan, header, folder, timeout, instance):
+    import requests
+    start = time.monotonic()
+    try:
+        if folder is None:
+            response = session.post(urlToScan, headers=header, timeout=timeout)
+        else:
+            response = session.post(urlToScan, headers=header, params={"folder": folder}, timeout=timeout)
+        res = ScanResult(folder, response.status_code, response.text, time.monotonic() - start)
+    except requests.exceptions.Timeout:
+        res = ScanResult(folder, 408, "Timeout has occurred while scanning the folder", time.monotonic() - start)
+    except Exception as e:
+        res = ScanResult(folder, 500, str(e), time.monotonic() - start)
+
+    metrics.SCAN_REQUEST_SECONDS.labels(instance, folder if folder is not None else "*").observe(res.duration)
+    return res
+
+
+def dispatchScans(config, folders):
+    """Scans the given folders concurrently (at most config.scanConcurrency at once) and returns a ScanResult per folder.
+    Folders that did not finish before config.scanOverallTimeout are reported with code 408."""
+    return dispatchPlan(config, [PlannedScan(folder) for folder in folders], None)
+
+
+def dispatchPlan(config, plan, maxConcurrentBytes):
+    """Sends the planned scans in order, each not before its planned start, while keeping at most
+    config.scanConcurrency folders (and, if set, maxConcurrentBytes of folder data) scanning at the same time."""
+    header = {"X-API-Key": config.apiKey}
+    urlToScan = f"{config.url}/rest/db/scan"
+    session = getSession(config.url, config.scanConcurrency)
+    hostSlots = getHostSlots(config.url, config.hostConcurrency)
+    concurrency = max(config.scanConcurrency, 1)
+    start = time.monotonic()
+    lastPlannedStart = max((p.plannedStart for p in plan), default=0)
+    deadline = start + lastPlannedStart + config.scanOverallTimeout
+
+    gate = threading.Condition()
+    inFlight = {"count": 0, "bytes": 0}
+
+    def hasRoom(item):
+        if inFlight["count"] >= concurrency:
+            return False
+        # a folder bigger than the byte limit is still scanned - just alone
+        return maxConcurrentBytes is None or inFlight["count"] == 0 or \
+            inFlight["bytes"] + (item.sizeBytes or 0) <= maxConcurrentBytes
+
+    def runScan(item, actualStart):
+        try:
+            with hostSlots:
+                res = scanFolder(session, urlToScan, header, item.folder, config.scanRequestTimeout, config.name)
+        finally:
+            with gate:
+                inFlight["count"] -= 1
+                inFlight["bytes"] -= item.sizeBytes or 0
+                gate.notify_all()
+        res.plannedStart, res.actualStart, res.sizeBytes = item.plannedStart, actualStart, item.sizeBytes
+        return res
+
+    def timedOut(item):
+        return ScanResult(item.folder, 408, "Overall scan deadline exceeded before the folder finished",
+                          config.scanOverallTimeout, item.plannedStart, None, item.sizeBytes)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="scan")
+    try:
+        futures = []
+        for item in plan:
+            waitUntil = min(start + item.plannedStart, deadline)
+            if waitUntil > time.monotonic():
+                time.sleep(waitUntil - time.monotonic())
+            with gate:
+                if not gate.wait_for(lambda: hasRoom(item), timeout=max(deadline - time.monotonic(), 0)):
+                    futures.append((item, None))
+                    continue
+                inFlight["count"] += 1
+                inFlight["bytes"] += item.sizeBytes or 0
+            futures.append((item, executor.submit(runScan, item, time.monotonic() - start)))
+
+        submitted = [future for item, future in futures if future is not None]
+        done, notDone = wait(submitted, timeout=max(deadline - time.monotonic(), 0))
+
+        results = []
+        for item, future in futures:
+            if future is not None and future in done:
+                results.append(future.result())
+            else:
+                if future is not None:
+                    future.cancel()
+                results.append(timedOut(item))
+        return results
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
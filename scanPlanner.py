@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import scanDispatcher
+
+# folder sizes change slowly, so they are only fetched again from syncthing after this many seconds
+SIZE_CACHE_SECONDS = 6 * 3600
+
+ORDERS = ["config", "largest_first", "smallest_first"]
+
+
+@dataclass
+class FolderSize:
+    sizeBytes: int
+    files: int
+    fetchedAt: float
+
+
+_sizeCache = {}
+_sizeCacheLock = threading.Lock()
+
+
+def isEnabled(config):
+    return config.scanStaggerMinutes > 0 or config.scanMaxConcurrentGB > 0 or config.scanOrder != "config"
+
+
+def fetchFolderStatuses(config, folders):
+    """Fetches /rest/db/status for all folders in one concurrent pass over the shared session.
+    Returns folder -> status dict, or None for folders whose status could not be fetched."""
+    header = {"X-API-Key": config.apiKey}
+    session = scanDispatcher.getSession(config.url, config.scanConcurrency)
+
+    def fetch(folder):
+        try:
+            response = session.get(f"{config.url}/rest/db/status", headers=header, params={"folder": folder},
+                                   timeout=config.scanRequestTimeout)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"Could not fetch the status of folder {folder}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(config.scanConcurrency, 1), thread_name_prefix="status") as executor:
+        return dict(zip(folders, executor.map(fetch, folders)))
+
+
+def cacheSizes(config, statuses):
+    # lets other passes over /rest/db/status (like the incremental check) fill the cache, so sizes aren't fetched twice
+    now = time.monotonic()
+    with _sizeCacheLock:
+        for folder, status in statuses.items():
+            if status is not None:
+                _sizeCache[(config.url, folder)] = FolderSize(status.get("localBytes", 0), status.get("localFiles", 0), now)
+
+
+def getFolderSizes(config, folders):
+    now = time.monotonic()
+    with _sizeCacheLock:
+        sizes = {f: _sizeCache.get((config.url, f)) for f in folders}
+    stale = [f for f, size in sizes.items() if size is None or now - size.fetchedAt > SIZE_CACHE_SECONDS]
+
+    if stale:
+        cacheSizes(config, fetchFolderStatuses(config, stale))
+        with _sizeCacheLock:
+            sizes = {f: _sizeCache.get((config.url, f)) for f in folders}
+    return sizes
+
+
+def planScans(config, folders):
+    """Orders the folders by size (if configured) and spreads their planned start evenly over the stagger window."""
+    sizes = getFolderSizes(config, folders)
+    plan = [scanDispatcher.PlannedScan(folder, sizes[folder].sizeBytes if sizes[folder] else None,
+                                       sizes[folder].files if sizes[folder] else None)
+            for folder in folders]
+
+    if config.scanOrder != "config":
+        plan.sort(key=lambda p: p.sizeBytes or 0, reverse=config.scanOrder == "largest_first")
+
+    windowSeconds = config.scanStaggerMinutes * 60
+    for i, item in enumerate(plan):
+        item.plannedStart = i * windowSeconds / len(plan)
+    return plan
+
+
+def maxConcurrentBytes(config):
+    return config.scanMaxConcurrentGB * 1000 ** 3 if config.scanMaxConcurrentGB > 0 else None
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+CRON_FIELD_NAMES = ["minute", "hour", "day", "month", "day_of_week"]
+# weekdays in cron order - 0 (and 7) is sunday in cron, while APScheduler counts from 0 = monday
+CRON_WEEKDAYS = ["sun", "mon", "tue", "wed", "thu", "fri", "sat"]
+
+
+@dataclass
+class ScheduleSpec:
+    instance: str
+    trigger: str
+    cronFields: dict
+    # like cron, fires when either the day or the day_of_week matches if both are restricted - not only when both do
+    eitherDay: bool = False
+
+
+def parseCronExpression(expression: str):
+    """Turns a standard 5 field cron expression (minute hour day month day_of_week) into APScheduler cron fields.
+    Raises ValueError if it is not valid."""
+    values = str(expression).split()
+    if len(values) != len(CRON_FIELD_NAMES):
+        raise ValueError(f"expected {len(CRON_FIELD_NAMES)} fields, got {len(values)}")
+    cronFields = dict(zip(CRON_FIELD_NAMES, values))
+    cronFields["day_of_week"] = cronDayOfWeek(cronFields["day_of_week"])
+    # building the trigger validates every field
+    buildTrigger(ScheduleSpec(None, None, cronFields, cronEitherDay(expression)), "UTC")
+    return cronFields
+
+
+def cronEitherDay(expression: str):
+    # like cron, a field starting with "*" (e.g. "*/2") doesn't count as restricting the days
+    day, dayOfWeek = str(expression).split()[2::2]
+    return not day.startswith("*") and not dayOfWeek.startswith("*")
+
+
+def cronDayOfWeek(value: str):
+    """Turns a cron day_of_week field into weekday names, as APScheduler reads its numbers, steps and named ranges
+    from monday on."""
+    if value == "*":
+        return value
+
+    def weekday(token):
+        if token.lower() in CRON_WEEKDAYS:
+            return CRON_WEEKDAYS.index(token.lower())
+        if not token.isdigit() or int(token) > 7:
+            raise ValueError(f"invalid day_of_week '{token}'")
+        return int(token)
+
+    days = set()
+    for item in value.split(","):
+        base, _, step = item.partition("/")
+        if step and not step.isdigit() or step == "0":
+            raise ValueError(f"invalid step in day_of_week '{item}'")
+        if base == "*":
+            first, last = 0, 6
+        elif "-" in base:
+            first, last = (weekday(token) for token in base.split("-", 1))
+            # "fri-sun" ends on the sunday at the end of the week
+            last = 7 if last == 0 and first > 0 else last
+        else:
+            first = weekday(base)
+            last = 6 if step else first
+        if first > last:
+            raise ValueError(f"invalid range in day_of_week '{item}'")
+        days.update(day % 7 for day in range(first, last + 1, int(step or 1)))
+    return ",".join(CRON_WEEKDAYS[day] for day in sorted(days))
+
+
+def scheduleSpecs(config):
+    # job id -> ScheduleSpec for every schedule of every instance that is set in the config
+    specs = {}
+    for instance in config.instances:
+        name = instance.name
+        if instance.dailySchedule is not None:
+            specs[f"{name}:daily"] = ScheduleSpec(name, "daily", dict(
+                minute=instance.dailySchedule.minute, hour=instance.dailySchedule.hour, day='*', month='*',
+                day_of_week='*'))
+        if instance.weeklySchedule is not None:
+            specs[f"{name}:weekly"] = ScheduleSpec(name, "weekly", dict(
+                minute=instance.weeklySchedule.minute, hour=instance.weeklySchedule.hour, day='*', month='*',
+                day_of_week=instance.weeklySchedule.day.lower()))
+        if instance.lastDayOfMonthSchedule is not None:
+            # "last mon" fires exactly on the last monday of every month, instead of checking the date every week
+            specs[f"{name}:lastDayOfMonth"] = ScheduleSpec(name, "lastDayOfMonth", dict(
+                minute=instance.lastDayOfMonthSchedule.minute, hour=instance.lastDayOfMonthSchedule.hour,
+                day=f"last {instance.lastDayOfMonthSchedule.day.lower()}", month='*', day_of_week='*'))
+        for i, expression in enumerate(instance.cronSchedules or []):
+            triggerName = "cron" if len(instance.cronSchedules) == 1 else f"cron{i + 1}"
+            specs[f"{name}:{triggerName}"] = ScheduleSpec(name, triggerName, parseCronExpression(expression),
+                                                          cronEitherDay(expression))
+    return specs
+
+
+def buildTrigger(spec: ScheduleSpec, tz):
+    # apscheduler is loaded on first use, so /status can come up before it during the startup
+    from apscheduler.triggers.cron import CronTrigger
+    fields = spec.cronFields
+    if spec.eitherDay:
+        # APScheduler only fires when both the day and the weekday match
+        from apscheduler.triggers.combining import OrTrigger
+        return OrTrigger([CronTrigger(timezone=tz, **{**fields, "day_of_week": "*"}),
+                          CronTrigger(timezone=tz, **{**fields, "day": "*"})])
+    return CronTrigger(timezone=tz, **fields)
+
+
+def nextFireTimes(spec: ScheduleSpec, tz, count: int, after: datetime):
+    """The next `count` fire times of the schedule after `after`, computed from the trigger alone - the scheduler and
+    its jobs are not touched."""
+    trigger = buildTrigger(spec, tz)
+    fireTimes = []
+    fireTime = trigger.get_next_fire_time(None, after)
+    while fireTime is not None and len(fireTimes) < count:
+        fireTimes.append(fireTime)
+        # the cron fields have a one minute resolution, so stepping a second past a fire time finds the next one
+        fireTime = trigger.get_next_fire_time(fireTime, fireTime + timedelta(seconds=1))
+    return fireTimes
@@ -1,59 +1,457 @@
+import os
 import sqlite3
+import threading
+import time
 from dataclasses import dataclass
+from datetime import datetime, timedelta
 from sqlite3 import Error
+import metrics
+import statusSnapshot
 import util
 
+# hidden env var to move the database file (the docker image binds /sqldb as a volume)
+DB_FILE = os.getenv("SQLITE_DB_PATH", r"/sqldb/nova.db")
+
+# status rows that don't belong to a syncthing instance (startup, config errors) are stored under this name
+SCHEDULER_INSTANCE = "scheduler"
+
+# retention is applied at most this often, so the hot write path doesn't pay for it
+COMPACTION_INTERVAL_SECONDS = 3600
+
 
 @dataclass
 class ApiResponse:
     code: int
     msg: str
     timestamp: str
+    trigger: str = None
+    instance: str = None
 
 
-def init_db(db_file):
-    conn = None
-    try:
-        conn = sqlite3.connect(db_file)
+@dataclass
+class FolderState:
+    sequence: int
+    globalFiles: int
+    needBytes: int
+    lastScan: str
+
+
+@dataclass
+class Lease:
+    holder: str
+    acquiredAt: float
+    expiresAt: float
+    term: int
+    # last renewal of the previous holder when this call took the lease over, otherwise None
+    previousRenewedAt: float = None
+
+
+@dataclass
+class BandwidthBoost:
+    target: str
+    # "options" for the global limits, otherwise the id of the device whose limits were raised
+    scope: str
+    maxSendKbps: int
+    maxRecvKbps: int
+    expiresAt: float
+
+
+@dataclass
+class SyncResult:
+    folder: str
+    device: str
+    # bytes the device received during the monitoring, from its highest needed bytes down to what it still needs
+    bytesTransferred: int
+    # seconds from the start of the monitoring until the device connected / reached 100%, None if it never did
+    connectSeconds: float
+    completeSeconds: float
+    mbPerSecond: float
+    completed: bool
+
+
+@dataclass
+class RetryState:
+    instance: str
+    # "*" stands for the instance as a whole (a run that failed before or in every folder)
+    folder: str
+    # consecutive failures - the circuit breaker opens once they reach the threshold
+    failures: int
+    attempt: int
+    nextRetryAt: float = None
+    openUntil: float = None
+    lastError: str = None
+
+
+@dataclass
+class RetentionPolicy:
+    days: int
+    maxRuns: int
+
+
+retention = RetentionPolicy(days=365, maxRuns=10000)
+
+_conn = None
+_dbFile = DB_FILE
+_lock = threading.RLock()
+_lastCompaction = None
+
+
+def _get_conn():
+    # one long lived connection shared by the scheduler and the api threads - access is serialized by _lock
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(_dbFile, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL;")
+        _conn.execute("PRAGMA synchronous=NORMAL;")
+        # replicas sharing the file wait for each other's write transactions instead of failing right away
+        _conn.execute("PRAGMA busy_timeout=5000;")
+        if _conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+            # switching an existing file to incremental vacuum only takes effect after a full VACUUM
+            _conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            _conn.execute("VACUUM;")
+        _create_schema(_conn)
+    return _conn
+
+
+def _create_schema(conn):
+    with conn:
+        # replaced by RUNS - the single row table was dropped on every start anyway
         conn.execute("DROP TABLE IF EXISTS LAST_STATUS;")
 
-        conn.execute('''CREATE TABLE IF NOT EXISTS LAST_STATUS
-                     (ID     INT          NOT NULL,
-                     CODE            INT     NOT NULL,
-                     LAST_RESPONSE        CHAR(1000),
-                     TIMESTAMP            CHAR(100)     NOT NULL);''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS RUNS
+                     (ID              INTEGER PRIMARY KEY AUTOINCREMENT,
+                     CODE             INT           NOT NULL,
+                     LAST_RESPONSE    TEXT,
+                     TIMESTAMP        CHAR(19)      NOT NULL);''')
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_RUNS_TIMESTAMP ON RUNS (TIMESTAMP);")
+        _add_column(conn, "RUNS", "TRIGGER", "TEXT")
+        _add_column(conn, "RUNS", "INSTANCE", f"TEXT NOT NULL DEFAULT '{SCHEDULER_INSTANCE}'")
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_RUNS_INSTANCE ON RUNS (INSTANCE, ID);")
+
+        conn.execute('''CREATE TABLE IF NOT EXISTS FOLDER_RESULTS
+                     (ID              INTEGER PRIMARY KEY AUTOINCREMENT,
+                     RUN_ID           INT           NOT NULL,
+                     FOLDER           TEXT          NOT NULL,
+                     CODE             INT           NOT NULL,
+                     MSG              TEXT,
+                     DURATION         REAL,
+                     TIMESTAMP        CHAR(19)      NOT NULL);''')
+        _add_column(conn, "FOLDER_RESULTS", "PLANNED_START", "REAL")
+        _add_column(conn, "FOLDER_RESULTS", "ACTUAL_START", "REAL")
+        _add_column(conn, "FOLDER_RESULTS", "SIZE_BYTES", "INT")
+        _add_column(conn, "FOLDER_RESULTS", "INSTANCE", f"TEXT NOT NULL DEFAULT '{SCHEDULER_INSTANCE}'")
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_FOLDER_RESULTS_INSTANCE ON FOLDER_RESULTS (INSTANCE, FOLDER, TIMESTAMP);")
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_FOLDER_RESULTS_RUN ON FOLDER_RESULTS (RUN_ID);")
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_FOLDER_RESULTS_FOLDER ON FOLDER_RESULTS (FOLDER, TIMESTAMP);")
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_FOLDER_RESULTS_TIMESTAMP ON FOLDER_RESULTS (TIMESTAMP);")
+
+        # last seen syncthing counters per folder, used to skip folders that didn't change since their last scan
+        conn.execute('''CREATE TABLE IF NOT EXISTS FOLDER_STATE
+                     (TARGET          TEXT          NOT NULL,
+                     FOLDER           TEXT          NOT NULL,
+                     SEQUENCE         INT,
+                     GLOBAL_FILES     INT,
+                     NEED_BYTES       INT,
+                     LAST_SCAN        CHAR(19)      NOT NULL,
+                     PRIMARY KEY (TARGET, FOLDER));''')
 
-        conn.commit()
-        print(f"Successfully initialized sqlite db: {sqlite3.version}")
+        # leases for electing the one replica that executes the runs
+        conn.execute('''CREATE TABLE IF NOT EXISTS LEASES
+                     (NAME            TEXT          PRIMARY KEY,
+                     HOLDER           TEXT          NOT NULL,
+                     ACQUIRED_AT      REAL          NOT NULL,
+                     RENEWED_AT       REAL          NOT NULL,
+                     EXPIRES_AT       REAL          NOT NULL,
+                     TERM             INT           NOT NULL);''')
+
+        # the last fire time of every schedule, so runs missed while the scheduler was down can be caught up on
+        conn.execute('''CREATE TABLE IF NOT EXISTS SCHEDULE_RUNS
+                     (JOB_ID          TEXT          PRIMARY KEY,
+                     LAST_FIRED       TEXT          NOT NULL);''')
+
+        # the original syncthing rate limits while they are raised for a backup window, so they survive a crash
+        conn.execute('''CREATE TABLE IF NOT EXISTS BANDWIDTH_BOOSTS
+                     (TARGET          TEXT          NOT NULL,
+                     SCOPE            TEXT          NOT NULL,
+                     MAX_SEND_KBPS    INT           NOT NULL,
+                     MAX_RECV_KBPS    INT           NOT NULL,
+                     EXPIRES_AT       REAL          NOT NULL,
+                     PRIMARY KEY (TARGET, SCOPE));''')
+
+        # failed folders waiting for a retry and their circuit breakers
+        conn.execute('''CREATE TABLE IF NOT EXISTS RETRY_STATE
+                     (INSTANCE        TEXT          NOT NULL,
+                     FOLDER           TEXT          NOT NULL,
+                     FAILURES         INT           NOT NULL,
+                     ATTEMPT          INT           NOT NULL,
+                     NEXT_RETRY_AT    REAL,
+                     OPEN_UNTIL       REAL,
+                     LAST_ERROR       TEXT,
+                     PRIMARY KEY (INSTANCE, FOLDER));''')
+
+        # how the remote devices received the data after a run, per folder and device
+        conn.execute('''CREATE TABLE IF NOT EXISTS SYNC_RESULTS
+                     (ID              INTEGER PRIMARY KEY AUTOINCREMENT,
+                     RUN_ID           INT,
+                     INSTANCE         TEXT          NOT NULL,
+                     FOLDER           TEXT          NOT NULL,
+                     DEVICE           TEXT          NOT NULL,
+                     BYTES            INT           NOT NULL,
+                     CONNECT_SECONDS  REAL,
+                     COMPLETE_SECONDS REAL,
+                     MB_PER_SECOND    REAL,
+                     COMPLETED        INT           NOT NULL,
+                     TIMESTAMP        CHAR(19)      NOT NULL);''')
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_SYNC_RESULTS_DEVICE ON SYNC_RESULTS (INSTANCE, DEVICE, TIMESTAMP);")
+        conn.execute("CREATE INDEX IF NOT EXISTS IDX_SYNC_RESULTS_TIMESTAMP ON SYNC_RESULTS (TIMESTAMP);")
+
+
+def _add_column(conn, table, column, columnType):
+    # lightweight migration for databases created by an older version
+    existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table});")]
+    if column not in existing:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {columnType};")
+
+
+def init_db(db_file):
+    global _conn, _dbFile
+    try:
+        with _lock:
+            if _conn is not None:
+                _conn.close()
+                _conn = None
+            _dbFile = db_file
+            _get_conn()
+            for status in get_latest_per_instance():
+                statusSnapshot.snapshot.publish(status)
+        print(f"Successfully initialized sqlite db: {sqlite3.sqlite_version}")
     except Error as e:
         print(f"Error initializing sqlite: {e}")
     finally:
-        if conn:
-            conn.close()
         update_db(200, "Initialized - waiting for first checks", util.getCurrentDateTime())
 
 
-def update_db(code: int, msg: str, timestamp: str):
-    conn = sqlite3.connect(r"/sqldb/nova.db")
-    conn.execute(
-        f"""INSERT OR IGNORE INTO LAST_STATUS (ID,CODE,LAST_RESPONSE,TIMESTAMP) VALUES (1, {code}, \'{msg}\', \'{timestamp}\')""")
-    conn.execute(
-        f"UPDATE LAST_STATUS SET LAST_RESPONSE=\'{msg}\', CODE = {code}, TIMESTAMP = \'{timestamp}\' WHERE ID=1; ")
+def set_retention(days: int, maxRuns: int):
+    retention.days = days
+    retention.maxRuns = maxRuns
 
-    conn.commit()
-    conn.close()
+
+def update_db(code: int, msg: str, timestamp: str, instance: str = None):
+    record_run(code, msg, timestamp, [], instance=instance)
+
+
+def record_run(code: int, msg: str, timestamp: str, folderResults, trigger: str = None, instance: str = None):
+    """Stores a run and its per folder results (scanDispatcher.ScanResult) in one transaction."""
+    instance = instance or SCHEDULER_INSTANCE
+    with _lock, metrics.SQLITE_WRITE_SECONDS.time():
+        conn = _get_conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO RUNS (CODE, LAST_RESPONSE, TIMESTAMP, TRIGGER, INSTANCE) VALUES (?, ?, ?, ?, ?);",
+                (code, msg, timestamp, trigger, instance))
+            runId = cur.lastrowid
+            conn.executemany(
+                '''INSERT INTO FOLDER_RESULTS (RUN_ID, FOLDER, CODE, MSG, DURATION, TIMESTAMP, PLANNED_START, ACTUAL_START,
+                SIZE_BYTES, INSTANCE) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);''',
+                [(runId, res.folder if res.folder is not None else "*", res.code, res.msg, res.duration, timestamp,
+                  res.plannedStart, res.actualStart, res.sizeBytes, instance) for res in folderResults])
+        statusSnapshot.snapshot.publish(
+            ApiResponse(code=code, msg=msg, timestamp=timestamp, trigger=trigger, instance=instance))
+
+        _compact_if_due(conn)
+        return runId
+
+
+def _compact_if_due(conn):
+    global _lastCompaction
+    now = time.monotonic()
+    if _lastCompaction is not None and now - _lastCompaction < COMPACTION_INTERVAL_SECONDS:
+        return
+    _lastCompaction = now
+
+    cutoff = (datetime.now() - timedelta(days=retention.days)).strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with conn:
+            row = conn.execute("SELECT ID FROM RUNS ORDER BY ID DESC LIMIT 1 OFFSET ?;", (retention.maxRuns,)).fetchone()
+            oldestKeptId = row[0] + 1 if row is not None else 0
+            conn.execute("DELETE FROM FOLDER_RESULTS WHERE TIMESTAMP < ? OR RUN_ID < ?;", (cutoff, oldestKeptId))
+            conn.execute("DELETE FROM SYNC_RESULTS WHERE TIMESTAMP < ? OR RUN_ID < ?;", (cutoff, oldestKeptId))
+            deleted = conn.execute("DELETE FROM RUNS WHERE TIMESTAMP < ? OR ID < ?;", (cutoff, oldestKeptId)).rowcount
+        if deleted > 0:
+            conn.execute("PRAGMA incremental_vacuum;").fetchall()
+            print(f"Removed {deleted} run(s) from the history according to the retention policy")
+    except Error as e:
+        print(f"Error while compacting the sqlite history: {e}")
+
+
+def get_folder_states(target: str):
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT FOLDER, SEQUENCE, GLOBAL_FILES, NEED_BYTES, LAST_SCAN FROM FOLDER_STATE WHERE TARGET = ?;",
+            (target,)).fetchall()
+    return {row[0]: FolderState(row[1], row[2], row[3], row[4]) for row in rows}
+
+
+def save_folder_states(target: str, states):
+    """Upserts folder -> FolderState for the target in one transaction."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                '''INSERT INTO FOLDER_STATE (TARGET, FOLDER, SEQUENCE, GLOBAL_FILES, NEED_BYTES, LAST_SCAN)
+                VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (TARGET, FOLDER) DO UPDATE SET SEQUENCE = excluded.SEQUENCE,
+                GLOBAL_FILES = excluded.GLOBAL_FILES, NEED_BYTES = excluded.NEED_BYTES, LAST_SCAN = excluded.LAST_SCAN;''',
+                [(target, folder, st.sequence, st.globalFiles, st.needBytes, st.lastScan) for folder, st in states.items()])
+
+
+def get_schedule_runs():
+    with _lock:
+        rows = _get_conn().execute("SELECT JOB_ID, LAST_FIRED FROM SCHEDULE_RUNS;").fetchall()
+    return {row[0]: datetime.fromisoformat(row[1]) for row in rows}
+
+
+def save_schedule_run(jobId: str, firedAt: datetime):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute('''INSERT INTO SCHEDULE_RUNS (JOB_ID, LAST_FIRED) VALUES (?, ?)
+                         ON CONFLICT (JOB_ID) DO UPDATE SET LAST_FIRED = excluded.LAST_FIRED;''',
+                         (jobId, firedAt.isoformat()))
+
+
+def save_bandwidth_boosts(boosts):
+    """Stores the original limits of every boost. A boost that is still stored keeps its original limits (they
+    are the ones from before the first boost) and only gets the new expiry."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                '''INSERT INTO BANDWIDTH_BOOSTS (TARGET, SCOPE, MAX_SEND_KBPS, MAX_RECV_KBPS, EXPIRES_AT)
+                VALUES (?, ?, ?, ?, ?) ON CONFLICT (TARGET, SCOPE) DO UPDATE SET EXPIRES_AT = excluded.EXPIRES_AT;''',
+                [(b.target, b.scope, b.maxSendKbps, b.maxRecvKbps, b.expiresAt) for b in boosts])
+
+
+def get_bandwidth_boosts(target: str = None):
+    with _lock:
+        rows = _get_conn().execute(
+            """SELECT TARGET, SCOPE, MAX_SEND_KBPS, MAX_RECV_KBPS, EXPIRES_AT FROM BANDWIDTH_BOOSTS
+            WHERE ? IS NULL OR TARGET = ?;""", (target, target)).fetchall()
+    return [BandwidthBoost(*row) for row in rows]
+
+
+def delete_bandwidth_boost(target: str, scope: str):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM BANDWIDTH_BOOSTS WHERE TARGET = ? AND SCOPE = ?;", (target, scope))
+
+
+def record_sync_results(runId: int, instance: str, timestamp: str, syncResults):
+    with _lock, metrics.SQLITE_WRITE_SECONDS.time():
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                '''INSERT INTO SYNC_RESULTS (RUN_ID, INSTANCE, FOLDER, DEVICE, BYTES, CONNECT_SECONDS, COMPLETE_SECONDS,
+                MB_PER_SECOND, COMPLETED, TIMESTAMP) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);''',
+                [(runId, instance, res.folder, res.device, res.bytesTransferred, res.connectSeconds,
+                  res.completeSeconds, res.mbPerSecond, 1 if res.completed else 0, timestamp) for res in syncResults])
+
+
+def get_sync_trend(since: str, instance: str = None, device: str = None):
+    """Daily aggregates of the sync results per instance and device since the given timestamp, oldest day first."""
+    with _lock:
+        rows = _get_conn().execute(
+            """SELECT INSTANCE, DEVICE, DATE(TIMESTAMP), COUNT(*), SUM(COMPLETED), SUM(BYTES), AVG(MB_PER_SECOND),
+            AVG(CONNECT_SECONDS), AVG(COMPLETE_SECONDS), MAX(COMPLETE_SECONDS) FROM SYNC_RESULTS
+            WHERE TIMESTAMP >= ? AND (? IS NULL OR INSTANCE = ?) AND (? IS NULL OR DEVICE = ?)
+            GROUP BY INSTANCE, DEVICE, DATE(TIMESTAMP) ORDER BY INSTANCE, DEVICE, DATE(TIMESTAMP);""",
+            (since, instance, instance, device, device)).fetchall()
+    return [{"instance": row[0], "device": row[1], "date": row[2], "results": row[3], "completed": row[4],
+             "bytes": row[5], "avgMBPerSecond": row[6], "avgConnectSeconds": row[7], "avgCompleteSeconds": row[8],
+             "maxCompleteSeconds": row[9]} for row in rows]
+
+
+def get_retry_states(instance: str = None):
+    with _lock:
+        rows = _get_conn().execute(
+            """SELECT INSTANCE, FOLDER, FAILURES, ATTEMPT, NEXT_RETRY_AT, OPEN_UNTIL, LAST_ERROR FROM RETRY_STATE
+            WHERE ? IS NULL OR INSTANCE = ? ORDER BY INSTANCE, FOLDER;""", (instance, instance)).fetchall()
+    return [RetryState(*row) for row in rows]
+
+
+def save_retry_states(instance: str, states, cleared):
+    """Upserts the RetryStates and deletes the folders in cleared (they succeeded) in one transaction."""
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                '''INSERT INTO RETRY_STATE (INSTANCE, FOLDER, FAILURES, ATTEMPT, NEXT_RETRY_AT, OPEN_UNTIL, LAST_ERROR)
+                VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (INSTANCE, FOLDER) DO UPDATE SET FAILURES = excluded.FAILURES,
+                ATTEMPT = excluded.ATTEMPT, NEXT_RETRY_AT = excluded.NEXT_RETRY_AT, OPEN_UNTIL = excluded.OPEN_UNTIL,
+                LAST_ERROR = excluded.LAST_ERROR;''',
+                [(s.instance, s.folder, s.failures, s.attempt, s.nextRetryAt, s.openUntil, s.lastError) for s in states])
+            conn.executemany("DELETE FROM RETRY_STATE WHERE INSTANCE = ? AND FOLDER = ?;",
+                             [(instance, folder) for folder in cleared])
+
+
+def get_last_run_folder_results():
+    with _lock:
+        rows = _get_conn().execute(
+            """SELECT FOLDER, CODE, DURATION FROM FOLDER_RESULTS WHERE RUN_ID = (SELECT MAX(ID) FROM RUNS);""").fetchall()
+    return [{"folder": row[0], "code": row[1], "duration": row[2]} for row in rows]
+
+
+def acquire_lease(name: str, holder: str, ttl: float, now: float):
+    """Renews the lease if holder has it, takes it over if it expired, and otherwise leaves it alone.
+    Runs in an IMMEDIATE transaction, so replicas sharing the database file can't both win. Returns the current lease."""
+    with _lock:
+        conn = _get_conn()
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            row = conn.execute("SELECT HOLDER, ACQUIRED_AT, RENEWED_AT, EXPIRES_AT, TERM FROM LEASES WHERE NAME = ?;",
+                               (name,)).fetchone()
+            if row is None:
+                lease = Lease(holder, now, now + ttl, 1)
+                conn.execute('''INSERT INTO LEASES (NAME, HOLDER, ACQUIRED_AT, RENEWED_AT, EXPIRES_AT, TERM)
+                             VALUES (?, ?, ?, ?, ?, ?);''', (name, holder, now, now, lease.expiresAt, lease.term))
+            elif row[0] == holder and row[3] >= now:
+                lease = Lease(holder, row[1], now + ttl, row[4])
+                conn.execute("UPDATE LEASES SET RENEWED_AT = ?, EXPIRES_AT = ? WHERE NAME = ?;",
+                             (now, lease.expiresAt, name))
+            elif row[3] < now:
+                lease = Lease(holder, now, now + ttl, row[4] + 1, previousRenewedAt=row[2])
+                conn.execute('''UPDATE LEASES SET HOLDER = ?, ACQUIRED_AT = ?, RENEWED_AT = ?, EXPIRES_AT = ?, TERM = ?
+                             WHERE NAME = ?;''', (holder, now, now, lease.expiresAt, lease.term, name))
+            else:
+                lease = Lease(row[0], row[1], row[3], row[4])
+            conn.commit()
+            return lease
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def release_lease(name: str, holder: str, now: float):
+    # lets another replica take over right away instead of waiting for the lease to expire
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("UPDATE LEASES SET EXPIRES_AT = ? WHERE NAME = ? AND HOLDER = ?;", (now, name, holder))
+
+
+def get_latest_per_instance():
+    with _lock:
+        rows = _get_conn().execute(
+            """SELECT CODE, LAST_RESPONSE, TIMESTAMP, TRIGGER, INSTANCE FROM RUNS
+            WHERE ID IN (SELECT MAX(ID) FROM RUNS GROUP BY INSTANCE);""").fetchall()
+    return [ApiResponse(code=row[0], msg=row[1], timestamp=row[2], trigger=row[3], instance=row[4]) for row in rows]
 
 
 def get_from_db():
-    lastResp = None
-    conn = sqlite3.connect(r"/sqldb/nova.db")
-    cur = conn.cursor()
-    cur.execute(f"""SELECT * FROM LAST_STATUS;""")
-    records = cur.fetchall()
-    row = records[0]
-    if records:
-        lastResp = ApiResponse(code=row[1], msg=row[2], timestamp=row[3])
-
-    conn.close()
-
-    return lastResp
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT CODE, LAST_RESPONSE, TIMESTAMP, TRIGGER, INSTANCE FROM RUNS ORDER BY ID DESC LIMIT 1;").fetchone()
+
+    if row is None:
+        return None
+    return ApiResponse(code=row[0], msg=row[1], timestamp=row[2], trigger=row[3], instance=row[4])
@@ -1,30 +1,166 @@
-import dataclasses
 import json
-from flask import Flask, abort, Response
+import os
+import threading
+from datetime import datetime, timedelta
+
+from flask import Flask, Response, abort, request
+
+import configInit
+import eventFeed
+import metrics
+import schedules
 import sqliteDB
+import statusSnapshot
 
 app = Flask("FlaskApp")
 
+# hidden env var to move the api to another port
+API_PORT = int(os.getenv("API_PORT", "1050"))
+API_THREADS = 16
+# long-polls hold a waitress thread each, so some threads are always left free for plain /status calls
+MAX_WAITERS = API_THREADS - 4
+# hidden env var to set how many /events streams can be open - they get their own waitress threads on top of the
+# ones above, so streams of clients that went away can't block the long-polls
+MAX_STREAMS = int(os.getenv("API_MAX_STREAMS", "16"))
+DEFAULT_WAIT_SECONDS = 30
+MAX_WAIT_SECONDS = 120
+# a client that gets a 503 from /status/wait or /events waits this long before it tries again
+RETRY_AFTER_SECONDS = 5
+# a comment line is sent on an idle /events stream, so proxies keep it open - a client that went away is only noticed
+# when a write fails, which frees its stream within about two heartbeats
+EVENTS_HEARTBEAT_SECONDS = 5
+DEFAULT_SCHEDULE_COUNT = 5
+MAX_SCHEDULE_COUNT = 100
+DEFAULT_TREND_DAYS = 30
+
+_waiters = threading.BoundedSemaphore(MAX_WAITERS)
+_streams = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def buildStatusResponse(resp, body, etag):
+    if resp is None:
+        return Response(body, status=400, content_type='application/json')
+    elif resp.code != 200:
+        return Response(body, status=resp.code, content_type='application/json', headers={"ETag": etag})
+
+    if request.if_none_match.contains_raw(etag):
+        return Response(status=304, headers={"ETag": etag})
+    return Response(body, mimetype='application/json', headers={"ETag": etag})
+
 
 @app.route("/status")
 def get_status():
-    resp = sqliteDB.get_from_db()
+    return buildStatusResponse(*statusSnapshot.snapshot.get())
 
-    if resp is not None:
-        respDict = dataclasses.asdict(resp)
-    else:
-        respDict = {"Error": "Cannot find response record. Maybe too soon?!"}
 
-    jsonResponse = json.dumps({"Response": respDict})
+@app.route("/status/<instance>")
+def get_instance_status(instance):
+    if instance not in statusSnapshot.snapshot.instances():
+        abort(404)
+    return buildStatusResponse(*statusSnapshot.snapshot.get(instance))
+
+
+@app.route("/status/wait")
+def wait_status():
+    instance = request.args.get("instance")
+    since = request.args.get("since")
+    if since is not None and not since.startswith("\""):
+        since = f"\"{since}\""
+    timeout = min(request.args.get("timeout", DEFAULT_WAIT_SECONDS, type=float), MAX_WAIT_SECONDS)
+
+    if not _waiters.acquire(blocking=False):
+        # too many open long-polls - answering right away would make the clients poll in a tight loop
+        return Response(status=503, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    try:
+        resp, body, etag = statusSnapshot.snapshot.waitForChange(since, timeout, instance)
+    finally:
+        _waiters.release()
+
+    if etag == since:
+        return Response(status=304, headers={"ETag": etag})
+    return Response(body, status=400 if resp is None else resp.code, content_type='application/json',
+                    headers={"ETag": etag} if etag is not None else None)
+
+
+@app.route("/events")
+def get_events():
+    """Server-sent events: the run lifecycle of the scheduler plus the Syncthing events of every instance. A client
+    that reconnects with Last-Event-ID gets the events it missed, as long as they are still buffered."""
+    lastEventId = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    cursor = int(lastEventId) if lastEventId is not None and lastEventId.isdigit() else eventFeed.feed.lastId()
+
+    if not _streams.acquire(blocking=False):
+        return Response(status=503, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    try:
+        eventFeed.connect()
+    except Exception:
+        _streams.release()
+        raise
+
+    def stream(cursor):
+        yield f"retry: {RETRY_AFTER_SECONDS * 1000}\n\n"
+        while True:
+            events, skipped, cursor = eventFeed.feed.read(cursor, EVENTS_HEARTBEAT_SECONDS)
+            if skipped:
+                metrics.SKIPPED_EVENTS.inc(skipped)
+                yield f"event: skipped\ndata: {json.dumps({'count': skipped})}\n\n"
+            if not events and not skipped:
+                # the config may only have been loaded (or reloaded with new instances) since the client connected
+                eventFeed.startRelays()
+                yield ": heartbeat\n\n"
+            for event in events:
+                yield event.frame
+
+    def close():
+        eventFeed.disconnect()
+        _streams.release()
+
+    response = Response(stream(cursor), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # called by waitress once the client is gone, even if the stream never started
+    response.call_on_close(close)
+    return response
+
+
+@app.route("/schedule")
+def get_schedule():
+    # computed from the config alone, so looking ahead never changes the jobs registered in the scheduler
+    config = configInit.getConfig()
+    if config is None:
+        return Response(json.dumps({"Response": {"Error": "The config is not loaded yet"}}), status=400,
+                        content_type='application/json')
+    count = max(1, min(request.args.get("count", DEFAULT_SCHEDULE_COUNT, type=int), MAX_SCHEDULE_COUNT))
+    instance = request.args.get("instance")
+    now = datetime.now().astimezone()
+
+    jobs = {}
+    for jobId, spec in schedules.scheduleSpecs(config).items():
+        if instance is not None and spec.instance != instance:
+            continue
+        jobs[jobId] = {"instance": spec.instance, "trigger": spec.trigger, "cronFields": spec.cronFields,
+                       "eitherDay": spec.eitherDay,
+                       "nextFireTimes": [t.isoformat() for t in schedules.nextFireTimes(spec, config.tz, count, now)]}
+    return Response(json.dumps({"Timezone": config.tz, "Schedules": jobs}), content_type='application/json')
+
+
+@app.route("/throughput")
+def get_throughput():
+    days = max(1, request.args.get("days", DEFAULT_TREND_DAYS, type=int))
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    trend = sqliteDB.get_sync_trend(since, request.args.get("instance"), request.args.get("device"))
+    return Response(json.dumps({"Days": days, "Trend": trend}), content_type='application/json')
 
-    if resp is None:
-        abort(Response(jsonResponse, status=400, content_type='application/json'))
-    elif resp.code != 200:
-        abort(Response(jsonResponse, status=resp.code, content_type='application/json'))
 
-    return Response(jsonResponse, mimetype='application/json')
+@app.route("/metrics")
+def get_metrics():
+    body, contentType = metrics.render()
+    return Response(body, content_type=contentType)
 
 
-def runApi():
-    from waitress import serve
-    serve(app, host='0.0.0.0', port=1050)
+def startApi():
+    """Binds the api port and serves it from a background thread - requests are accepted as soon as this returns."""
+    from waitress import create_server
+    server = create_server(app, host='0.0.0.0', port=API_PORT, threads=API_THREADS + MAX_STREAMS)
+    thread = threading.Thread(target=server.run, name="api", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,96 @@
+import dataclasses
+import hashlib
+import json
+import threading
+
+NOT_FOUND_BODY = json.dumps({"Response": {"Error": "Cannot find response record. Maybe too soon?!"}})
+
+
+def serialize(body: dict):
+    text = json.dumps(body)
+    return text, f"\"{hashlib.sha1(text.encode()).hexdigest()[:16]}\""
+
+
+class StatusSnapshot:
+    """The latest status of every instance plus an aggregate view, kept in memory together with the serialized bodies
+    and their ETags, so serving /status never touches sqlite. Writers call publish() and long-poll readers block in
+    waitForChange()."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._statuses = {}
+        self._retries = {}
+        self._views = {}
+        self._aggregate = (None, NOT_FOUND_BODY, None)
+
+    def publish(self, status):
+        with self._cond:
+            self._statuses[status.instance] = status
+            self._rebuildView(status.instance)
+            self._rebuildAggregate()
+            self._cond.notify_all()
+
+    def publishRetries(self, instance, retries: list):
+        """Sets the pending retries and open circuit breakers of the instance (a list of dicts, empty if none)."""
+        with self._cond:
+            if retries:
+                self._retries[instance] = retries
+            else:
+                self._retries.pop(instance, None)
+            if instance in self._statuses:
+                self._rebuildView(instance)
+                self._rebuildAggregate()
+            self._cond.notify_all()
+
+    def retain(self, instances):
+        """Forgets the statuses of instances that are not in `instances`, e.g. after they were removed from the config."""
+        with self._cond:
+            for instance in [i for i in self._statuses if i not in instances]:
+                del self._statuses[instance]
+                del self._views[instance]
+                self._retries.pop(instance, None)
+            self._rebuildAggregate()
+            self._cond.notify_all()
+
+    def _rebuildView(self, instance):
+        status = self._statuses[instance]
+        body = {"Response": dataclasses.asdict(status)}
+        if instance in self._retries:
+            body["Retries"] = self._retries[instance]
+        self._views[instance] = (status, *serialize(body))
+
+    def _rebuildAggregate(self):
+        if not self._statuses:
+            self._aggregate = (None, NOT_FOUND_BODY, None)
+            return
+        # any failing instance makes the aggregate fail - the most recent failure is shown, otherwise the latest status
+        failing = [s for s in self._statuses.values() if s.code != 200]
+        headline = max(failing or self._statuses.values(), key=lambda s: s.timestamp)
+        body = {"Response": dataclasses.asdict(headline),
+                "Instances": {name: dataclasses.asdict(s) for name, s in self._statuses.items()}}
+        retries = {name: r for name, r in self._retries.items() if name in self._statuses}
+        if retries:
+            body["Retries"] = retries
+        self._aggregate = (headline, *serialize(body))
+
+    def _view(self, instance):
+        if instance is None:
+            return self._aggregate
+        return self._views.get(instance, (None, NOT_FOUND_BODY, None))
+
+    def get(self, instance=None):
+        with self._cond:
+            return self._view(instance)
+
+    def instances(self):
+        with self._cond:
+            return list(self._statuses)
+
+    def waitForChange(self, since, timeout: float, instance=None):
+        """Returns as soon as the ETag differs from `since`, or with the unchanged snapshot after the timeout."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._view(instance)[2] != since, timeout=timeout)
+            return self._view(instance)
+
+
+snapshot = StatusSnapshot()
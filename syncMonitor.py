@@ -0,0 +1,144 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import metrics
+import scanDispatcher
+import sqliteDB
+import syncthingEvents
+import util
+
+MONITOR_EVENTS = ["FolderCompletion", "DeviceConnected"]
+
+_monitors = {}
+_monitorsLock = threading.Lock()
+
+
+@dataclass
+class PairState:
+    folder: str
+    device: str
+    needBytes: int
+    peakNeedBytes: int
+    completion: float
+    completedAt: float = None
+
+    @property
+    def complete(self):
+        return self.completion >= 100 and self.needBytes == 0
+
+
+def _get(config, path, params=None):
+    session = scanDispatcher.getSession(config.url, config.scanConcurrency)
+    response = session.get(f"{config.url}{path}", headers={"X-API-Key": config.apiKey}, params=params,
+                           timeout=config.scanRequestTimeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def listPairs(config, folders):
+    """(folder, device) for every remote device the folders are shared with - all unpaused folders if folders is None."""
+    myId = _get(config, "/rest/system/status").get("myID")
+    pairs = []
+    for folder in _get(config, "/rest/config/folders"):
+        if folder.get("paused", False) or (folders is not None and folder["id"] not in folders):
+            continue
+        pairs.extend((folder["id"], device["deviceID"]) for device in folder.get("devices", [])
+                     if device["deviceID"] != myId)
+    return pairs
+
+
+def monitorSync(config, folders, timeout: float):
+    """Follows the remote devices until every (folder, device) pair reached 100% or the timeout passed.
+    The baseline is read once per pair from /rest/db/completion, everything after that comes from a single event
+    subscription. Returns a sqliteDB.SyncResult per pair."""
+    subscription = syncthingEvents.EventSubscription(config, MONITOR_EVENTS)
+    subscription.start()
+    start = time.monotonic()
+
+    connections = _get(config, "/rest/system/connections").get("connections", {})
+    connectedAt = {device: start for device, conn in connections.items() if conn.get("connected")}
+    states = {}
+    for folder, device in listPairs(config, folders):
+        completion = _get(config, "/rest/db/completion", {"folder": folder, "device": device})
+        need = completion.get("needBytes", 0)
+        states[(folder, device)] = PairState(folder, device, need, need, completion.get("completion", 0))
+        if states[(folder, device)].complete:
+            states[(folder, device)].completedAt = start
+
+    deadline = start + timeout
+    while any(not s.complete for s in states.values()):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        for event in subscription.poll(min(remaining, 60)):
+            data = event.get("data") or {}
+            now = time.monotonic()
+            if event["type"] == "DeviceConnected":
+                connectedAt.setdefault(data.get("id"), now)
+                continue
+            state = states.get((data.get("folder"), data.get("device")))
+            if state is None:
+                continue
+            state.needBytes = data.get("needBytes", 0)
+            state.peakNeedBytes = max(state.peakNeedBytes, state.needBytes)
+            state.completion = data.get("completion", 0)
+            if state.complete and state.completedAt is None:
+                state.completedAt = now
+            elif not state.complete:
+                state.completedAt = None
+
+    results = []
+    for state in states.values():
+        transferred = state.peakNeedBytes - state.needBytes
+        deviceConnectedAt = connectedAt.get(state.device)
+        mbPerSecond = None
+        if state.completedAt is not None and deviceConnectedAt is not None and transferred > 0:
+            # the transfer can only start once the device is connected
+            transferSeconds = state.completedAt - deviceConnectedAt
+            mbPerSecond = transferred / 1000 ** 2 / transferSeconds if transferSeconds > 0 else None
+        results.append(sqliteDB.SyncResult(
+            state.folder, state.device, transferred,
+            deviceConnectedAt - start if deviceConnectedAt is not None else None,
+            state.completedAt - start if state.completedAt is not None else None,
+            mbPerSecond, state.complete))
+    return results
+
+
+def printSyncResults(config, results):
+    print(f"Sync results of {config.name} per folder and remote device:")
+    for res in results:
+        speed = f", {res.mbPerSecond:.2f} MB/s" if res.mbPerSecond is not None else ""
+        if res.completed:
+            print(f"- {res.folder} -> {res.device[:7]}: {res.bytesTransferred / 1000 ** 2:.1f} MB in {res.completeSeconds:.0f}s{speed}")
+        else:
+            print(f"- {res.folder} -> {res.device[:7]}: NOT in sync (received {res.bytesTransferred / 1000 ** 2:.1f} MB)")
+
+
+def _monitor(config, folders, runId):
+    timestamp = util.getCurrentDateTime()
+    try:
+        results = monitorSync(config, folders, config.syncMonitorTimeoutMinutes * 60)
+    except Exception as e:
+        print(f"ERROR: could not monitor the sync of {config.name} to its remote devices: {e}")
+        return
+    printSyncResults(config, results)
+    sqliteDB.record_sync_results(runId, config.name, timestamp, results)
+    for res in results:
+        if res.completed:
+            metrics.SYNC_COMPLETE_SECONDS.labels(config.name, res.device).observe(res.completeSeconds)
+        if res.mbPerSecond is not None:
+            metrics.SYNC_MB_PER_SECOND.labels(config.name, res.device).set(res.mbPerSecond)
+
+
+def monitorInBackground(config, folders, runId):
+    """Starts monitoring the sync after a run, unless the previous run of the instance is still being monitored."""
+    with _monitorsLock:
+        monitor = _monitors.get(config.name)
+        if monitor is not None and monitor.is_alive():
+            print(f"The sync of the previous run of {config.name} is still being monitored - not monitoring this one")
+            return
+        monitor = threading.Thread(target=_monitor, args=(config, folders, runId), name=f"sync-{config.name}",
+                                   daemon=True)
+        _monitors[config.name] = monitor
+        monitor.start()
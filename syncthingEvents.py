@@ -0,0 +1,120 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import scanDispatcher
+import util
+
+# states a folder passes through while syncthing is hashing it
+SCANNING_STATES = ["scan-waiting", "scanning"]
+
+
+@dataclass
+class FolderScanState:
+    folder: str
+    started: bool = False
+    finished: bool = False
+    failed: bool = False
+    duration: float = None
+    progress: str = None
+
+
+@dataclass
+class ScanWaitResult:
+    finished: Dict[str, float] = field(default_factory=dict)
+    failed: List[str] = field(default_factory=list)
+    unfinished: Dict[str, str] = field(default_factory=dict)
+
+
+class EventSubscription:
+    """A single long-poll subscription on syncthing's /rest/events, filtered to the given event types.
+    The cursor is kept between polls, so no event is seen twice and none is missed."""
+
+    def __init__(self, config, eventTypes):
+        self.url = f"{config.url}/rest/events"
+        self.header = {"X-API-Key": config.apiKey}
+        # a long-poll holds its connection for up to a minute, so it gets its own instead of one of the scan pool
+        self.session = scanDispatcher.newSession(1)
+        self.eventTypes = ",".join(eventTypes)
+        self.lastId = 0
+
+    def start(self):
+        # move the cursor to the newest event so only events that happen from now on are returned
+        events = self._get({"events": self.eventTypes, "limit": 1, "timeout": 1}, 30)
+        self.lastId = max((e["id"] for e in events), default=0)
+
+    def poll(self, timeout: int):
+        events = self._get({"events": self.eventTypes, "since": self.lastId, "timeout": max(int(timeout), 1)},
+                           timeout + 30)
+        if not events and self._wasRestarted():
+            # syncthing was restarted and its event ids started over - the events since then are all new
+            print("Syncthing event ids were reset - following the new event stream")
+            events = self._get({"events": self.eventTypes, "since": 0, "timeout": 1}, 30)
+            self.lastId = 0
+        if events:
+            self.lastId = events[-1]["id"]
+        return events
+
+    def _wasRestarted(self):
+        # syncthing only returns ids above `since`, so after a restart the long-poll stays empty instead of failing.
+        # The newest event of any type (there are always some after a start) is below the cursor then
+        newest = self._get({"since": 0, "limit": 1, "timeout": 1}, 30)
+        return bool(newest) and newest[-1]["id"] < self.lastId
+
+    def _get(self, params, requestTimeout):
+        response = self.session.get(self.url, headers=self.header, params=params, timeout=requestTimeout)
+        response.raise_for_status()
+        return response.json() or []
+
+
+def getFolderIds(config):
+    session = scanDispatcher.getSession(config.url, config.scanConcurrency)
+    response = session.get(f"{config.url}/rest/config/folders", headers={"X-API-Key": config.apiKey},
+                           timeout=config.scanRequestTimeout)
+    response.raise_for_status()
+    return [folder["id"] for folder in response.json() if not folder.get("paused", False)]
+
+
+def waitForScans(subscription: EventSubscription, folders, timeout: float):
+    """Follows the subscription until every folder went from scanning back to idle, or until the timeout passes."""
+    states = {folder: FolderScanState(folder) for folder in folders}
+    startedAt = {}
+    deadline = time.monotonic() + timeout
+
+    while any(not s.finished for s in states.values()):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        for event in subscription.poll(min(remaining, 60)):
+            data = event.get("data") or {}
+            state = states.get(data.get("folder"))
+            if state is None or state.finished:
+                continue
+
+            if event["type"] == "FolderScanProgress":
+                state.progress = f"{data.get('current')}/{data.get('total')} bytes"
+            elif event["type"] == "StateChanged":
+                # events can arrive in batches, so durations are taken from syncthing's own event timestamps
+                eventTime = util.parseSyncthingTime(event.get("time", ""))
+                if data.get("to") in SCANNING_STATES:
+                    if not state.started:
+                        startedAt[state.folder] = eventTime
+                    state.started = True
+                elif state.started and data.get("from") in SCANNING_STATES:
+                    state.finished = True
+                    state.failed = data.get("to") == "error"
+                    if eventTime is not None and startedAt[state.folder] is not None:
+                        state.duration = (eventTime - startedAt[state.folder]).total_seconds()
+                    else:
+                        state.duration = data.get("duration")
+
+    result = ScanWaitResult()
+    for state in states.values():
+        if state.finished and not state.failed:
+            result.finished[state.folder] = state.duration
+        elif state.failed:
+            result.failed.append(state.folder)
+        else:
+            result.unfinished[state.folder] = state.progress or ("scanning" if state.started else "not started")
+    return result
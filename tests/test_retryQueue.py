@@ -0,0 +1,57 @@
+import pytest
+
+import configInit
+import retryQueue
+import sqliteDB
+from scanDispatcher import ScanResult
+
+
+@pytest.fixture
+def config(tmp_path):
+    sqliteDB.init_db(str(tmp_path / "retries.db"))
+    from apscheduler.schedulers.background import BackgroundScheduler
+    retryQueue.start(BackgroundScheduler(timezone="UTC"), lambda instance, folders: None)
+    return configInit.Config(url="http://syncthing:8384", apiKey="key", foldersToScan=["a", "b"], allFolders=False,
+                             weeklySchedule=None, dailySchedule=None, lastDayOfMonthSchedule=None, tz="UTC",
+                             WOLImage=None, WOLMacAddr=None, breakerThreshold=2)
+
+
+def states(config):
+    return {state.folder: state for state in sqliteDB.get_retry_states(config.name)}
+
+
+def test_unchanged_incremental_run_is_not_retried(config):
+    retryQueue.onResults(config, 200, [])
+    assert states(config) == {}
+
+
+def test_failure_after_successful_scans_is_not_retried(config):
+    # e.g. the wake on lan failed after every folder was scanned
+    retryQueue.onResults(config, 500, [ScanResult("a", 200, "", 0.1), ScanResult("b", 200, "", 0.1)])
+    assert states(config) == {}
+
+
+def test_failed_folder_is_retried_until_it_succeeds(config):
+    retryQueue.onResults(config, 500, [ScanResult("a", 200, "", 0.1), ScanResult("b", 503, "busy", 0.1)])
+    failed = states(config)
+    assert list(failed) == ["b"]
+    assert failed["b"].attempt == 1 and failed["b"].nextRetryAt is not None
+
+    retryQueue.onResults(config, 200, [ScanResult("b", 200, "", 0.1)], retriedFolders=["b"])
+    assert states(config) == {}
+
+
+def test_breaker_opens_after_consecutive_failed_runs(config):
+    retryQueue.onResults(config, 500, [])
+    wholeRun = states(config)[retryQueue.ALL_FOLDERS]
+    assert wholeRun.failures == 1 and wholeRun.nextRetryAt is not None and wholeRun.openUntil is None
+
+    retryQueue.onResults(config, 500, [], retriedFolders=[retryQueue.ALL_FOLDERS])
+    wholeRun = states(config)[retryQueue.ALL_FOLDERS]
+    assert wholeRun.failures == 2 and wholeRun.nextRetryAt is None
+    assert retryQueue.isOpen(wholeRun, wholeRun.openUntil - 1)
+
+
+def test_non_retryable_failure_is_not_retried(config):
+    retryQueue.onResults(config, 500, [ScanResult("a", 404, "no such folder", 0.1)])
+    assert states(config)["a"].nextRetryAt is None
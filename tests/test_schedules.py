@@ -0,0 +1,45 @@
+from datetime import datetime, timezone
+
+import configInit
+import schedules
+
+
+def config(expression):
+    conf = configInit.Config(url="http://syncthing:8384", apiKey="key", foldersToScan=None, allFolders=True,
+                             weeklySchedule=None, dailySchedule=None, lastDayOfMonthSchedule=None, tz="UTC",
+                             WOLImage=None, WOLMacAddr=None, cronSchedules=[expression])
+    conf.instances = [conf]
+    return conf
+
+
+def nextFireTime(expression, after):
+    spec = schedules.ScheduleSpec("default", "cron", schedules.parseCronExpression(expression))
+    return schedules.nextFireTimes(spec, "UTC", 1, after)[0]
+
+
+def test_cron_sunday_is_zero():
+    # 2026-10-19 is a monday
+    after = datetime(2026, 10, 19, tzinfo=timezone.utc)
+    assert nextFireTime("* * * * 0", after).strftime("%a") == "Sun"
+    assert nextFireTime("* * * * 7", after).strftime("%a") == "Sun"
+
+
+def test_cron_weekday_range():
+    after = datetime(2026, 10, 17, 12, tzinfo=timezone.utc)
+    spec = schedules.ScheduleSpec("default", "cron", schedules.parseCronExpression("0 2 * * 1-5"))
+    fireTimes = schedules.nextFireTimes(spec, "UTC", 5, after)
+    assert [t.strftime("%a") for t in fireTimes] == ["Mon", "Tue", "Wed", "Thu", "Fri"]
+
+
+def test_cron_day_or_weekday():
+    # like cron, a restricted day and day_of_week fire on either - the 1st and every monday
+    after = datetime(2026, 10, 17, 12, tzinfo=timezone.utc)
+    spec = schedules.scheduleSpecs(config("0 2 1 * 1"))["default:cron"]
+    fireTimes = schedules.nextFireTimes(spec, "UTC", 4, after)
+    assert [t.strftime("%a %d") for t in fireTimes] == ["Mon 19", "Mon 26", "Sun 01", "Mon 02"]
+
+
+def test_cron_weekday_names():
+    assert schedules.cronDayOfWeek("sun-mon") == "sun,mon"
+    assert schedules.cronDayOfWeek("fri-sun") == "sun,fri,sat"
+    assert schedules.cronDayOfWeek("mon-fri") == "mon,tue,wed,thu,fri"
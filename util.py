@@ -1,3 +1,4 @@
+import re
 import time
 from datetime import datetime
 
@@ -31,3 +32,14 @@ def fixString(inStr: str):
     filtered_characters = list(s for s in inStr if s.isprintable())
     fixed = ''.join(filtered_characters)
     return fixed.replace("'", "\"")
+
+
+def parseSyncthingTime(inTime: str):
+    # syncthing sends RFC3339 timestamps with nanoseconds, which datetime.fromisoformat can't read as is
+    match = re.match(r"^(.*T\d{2}:\d{2}:\d{2})(?:\.(\d+))?(Z|[+-]\d{2}:\d{2})?$", inTime)
+    if match is None:
+        return None
+    base, fraction, zone = match.groups()
+    fraction = (fraction or "0")[:6].ljust(6, "0")
+    zone = "+00:00" if zone in [None, "Z"] else zone
+    return datetime.fromisoformat(f"{base}.{fraction}{zone}")
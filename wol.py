@@ -0,0 +1,79 @@
+import socket
+import threading
+import time
+
+import metrics
+
+_dockerClient = None
+_dockerLock = threading.Lock()
+
+# how long a single connection attempt of the host probe may take and the longest pause between two attempts
+PROBE_CONNECT_TIMEOUT = 5
+PROBE_MAX_BACKOFF = 30
+
+
+def getDockerClient():
+    # the docker socket is only needed for the fallback, so the client (and the docker module) are loaded on first use
+    global _dockerClient
+    with _dockerLock:
+        if _dockerClient is None:
+            import docker
+            _dockerClient = docker.DockerClient(base_url='unix://var/run/docker.sock')
+        return _dockerClient
+
+
+def buildMagicPacket(macAddr: str):
+    macBytes = bytes.fromhex(macAddr.replace(":", "").replace("-", ""))
+    return b"\xff" * 6 + macBytes * 16
+
+
+def sendMagicPacket(macAddr: str, broadcastAddr: str, port: int, repeat: int):
+    packet = buildMagicPacket(macAddr)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        for i in range(repeat):
+            sock.sendto(packet, (broadcastAddr, port))
+            if i < repeat - 1:
+                time.sleep(0.1)
+
+
+def sendWithDocker(config):
+    WOLEnvVars = {"MAC": config.WOLMacAddr}
+    getDockerClient().containers.run(config.WOLImage, network_mode="host", name="WOL-syncthing-scheduler",
+                                     remove=True, environment=WOLEnvVars)
+
+
+def wakeUp(config):
+    """Sends the magic packet from this process, falling back to the docker WOL image only if that fails
+    (or if it is forced with wake_on_lan_settings.use_docker)."""
+    if not config.WOLUseDocker:
+        try:
+            with metrics.WOL_SECONDS.labels("socket").time():
+                sendMagicPacket(config.WOLMacAddr, config.WOLBroadcastAddr, config.WOLPort, config.WOLRepeat)
+            return
+        except OSError as e:
+            if config.WOLImage is None:
+                raise
+            print(f"Could not send the WOL packet directly ({e}) - falling back to the docker image {config.WOLImage}")
+    with metrics.WOL_SECONDS.labels("docker").time():
+        sendWithDocker(config)
+
+
+def waitForHost(host: str, port: int, timeout: float):
+    """Tries to open a TCP connection to host:port with exponential backoff. Returns the seconds it took for the host
+    to accept a connection, or None if it didn't come online before the timeout."""
+    start = time.monotonic()
+    deadline = start + timeout
+    backoff = 1
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=PROBE_CONNECT_TIMEOUT):
+                return time.monotonic() - start
+        except OSError:
+            pass
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, PROBE_MAX_BACKOFF)